@@ -1,40 +1,211 @@
+import io
+import json
+import os
 import streamlit as st
 import pandas as pd
-from modul import DataFilterAndSelect, ConfigurationInput, PaymentCount, PaymentExcelBuilder
-
-# Load pricing data
-harga_galian_lokal = pd.read_csv("hg_galian_lokal.csv")
-harga_galian_luar = pd.read_csv("hg_galian_luar.csv")
-harga_samplingan_lokal = pd.read_csv("hg_samplingan_lokal.csv")
-harga_samplingan_luar = pd.read_csv("hg_samplingan_luar.csv")
+from cache import DiskCache, fingerprint_frame
+from entities import ENTITY_COLUMNS
+from framestore import SharedFrameStore
+from instrumentation import Instrumentation, count_rows
+from jobs import JobRunner
+from ledger import PaymentLedger
+from modul import CATEGORY_COLUMNS, DataFilterAndSelect, PaymentCount, PaymentExcelBuilder
+from pipeline import build_payment_pipeline, load_price_tables, load_tariff_config, read_location_template
+from scenario import evaluate_scenarios
+from tarif import TariffConfig
+
+# Load pricing data (dikompilasi sekali menjadi indeks harga)
+harga_galian_lokal, harga_galian_luar, harga_samplingan_lokal, harga_samplingan_luar = load_price_tables()
+# Aturan tarif deklaratif (opsional), di-resolve per IUP yang dipilih di Tab 3 (default GAJIAN_IUP)
+tariff_config = load_tariff_config(os.environ.get("GAJIAN_TARIF", "tarif.json"))
+DEFAULT_IUP = os.environ.get("GAJIAN_IUP", "BEST")
+# Proses untuk rantai harga_* pada data besar (1 = serial)
+PRICING_WORKERS = int(os.environ.get("GAJIAN_PRICING_WORKERS", "1"))
 
 @st.cache_data(show_spinner=False)
 def convert_for_download(df):
     return df.to_csv(index=False).encode("utf-8")
 
+@st.cache_resource(show_spinner=False)
+def get_upload_cache():
+    return DiskCache(
+        os.environ.get("GAJIAN_CACHE_DIR", os.path.join(".cache", "uploads")),
+        max_bytes=int(os.environ.get("GAJIAN_CACHE_MAX_MB", "512")) * 1024 * 1024,
+    )
+
 @st.cache_data(show_spinner=False)
 def process_uploaded_csv(file):
-    df = pd.read_csv(file, encoding="utf-8")
-    clean_data = DataFilterAndSelect(df)
-    return clean_data.filter_and_select()
-
-def merge_stage3_with_stage2(stage3_df, stage2_df):
-    if stage3_df is None or stage2_df is None:
-        return stage3_df
-    return pd.merge(
-        stage3_df,
-        stage2_df,
-        how="left",
-        left_on="Penggali",
-        right_on="Penggali"
-    )
+    # Hasil bersih disimpan sebagai Parquet dengan kunci hash isi file, tahan restart server
+    data = file.getvalue()
+    cache = get_upload_cache()
+    key = DiskCache.content_key(data, "clean", DataFilterAndSelect.COLUMNS, DataFilterAndSelect.DTYPES, CATEGORY_COLUMNS, ENTITY_COLUMNS)
+    clean_data = cache.get_frame(key)
+    if clean_data is None:
+        clean_data = DataFilterAndSelect.from_csv(io.BytesIO(data), engine="pyarrow").filter_and_select()
+        cache.put_frame(key, clean_data)
+    return clean_data
+
+@st.cache_resource(show_spinner=False)
+def get_job_runner():
+    # Perhitungan gajian dan render Excel berjalan di thread latar belakang; hasilnya diambil di rerun berikutnya
+    return JobRunner(max_workers=int(os.environ.get("GAJIAN_JOB_WORKERS", "2")))
+
+def run_payment_job(job, compute, rows):
+    # set_data, 4 harga_* (atau satu price_parallel, sesuai keputusan PaymentCount.price), get_result
+    job.expect(3 if PaymentCount.partitions(rows, PRICING_WORKERS) > 1 else 6)
+    return compute()
+
+def run_excel_job(job, df, date_text, signers, instrumentation):
+    workers = int(os.environ.get("GAJIAN_EXCEL_WORKERS", "1"))
+    job.expect(1 if workers > 1 else len(PaymentExcelBuilder.SHEET_CONFIGS) + 1)
+    return PaymentExcelBuilder(df, instrumentation).to_bytes(date_text=date_text, signers=signers, workers=workers)
+
+def get_job(kind):
+    job_id = st.session_state.get(f"{kind}_job")
+    return get_job_runner().get(job_id) if job_id else None
+
+def collect_payment_job():
+    # Hasil job pembayaran yang sudah selesai dipindah ke store sesi (sekali per job)
+    job = get_job("payment")
+    if job is None or job.status != "done" or st.session_state.get("payment_collected") == job.id:
+        return False
+    get_session_frames()["payment"] = job.result
+    st.session_state["payment_ready"] = True
+    st.session_state["payment_collected"] = job.id
+    return True
+
+@st.fragment(run_every=1)
+def show_job_status(kind, label):
+    # Fragment dirender ulang tiap detik selama job berjalan; saat selesai seluruh app di-rerun
+    job = get_job(kind)
+    if job is None:
+        return
+    if not job.finished:
+        st.progress(job.progress, text=f"{label}: {job.message or job.status}")
+        if st.button("⏹️ Batalkan", key=f"cancel_{kind}"):
+            job.cancel()
+        return
+    if st.session_state.get(f"{kind}_seen") != job.id:
+        st.session_state[f"{kind}_seen"] = job.id
+        st.rerun(scope="app")
+    if job.status == "error":
+        st.error(f"❌ {label} gagal: {job.error}")
+    elif job.status == "cancelled":
+        st.warning(f"⏹️ {label} dibatalkan.")
+
+@st.cache_resource(show_spinner=False)
+def get_ledger():
+    # Ledger opsional: aktif jika GAJIAN_LEDGER berisi path file SQLite
+    path = os.environ.get("GAJIAN_LEDGER")
+    return PaymentLedger(path) if path else None
+
+def get_session_iup():
+    # IUP dari Tab 3 (widget ber-key); dipakai untuk tarif per IUP dan ledger
+    return st.session_state.get("iup", DEFAULT_IUP)
+
+def get_ledger_period():
+    # Periode ledger dari Tanggal Dokumen di Tab 3 (widget ber-key, jadi terbaca juga dari Tab 2)
+    date_input = st.session_state.get("date_input")
+    return date_input.strftime("%Y-%m") if date_input else None
+
+@st.cache_resource(show_spinner=False)
+def get_frame_store():
+    # Satu store untuk semua sesi: input identik antar admin disimpan sekali, sesi idle dibuang saat penuh
+    return SharedFrameStore(max_bytes=int(os.environ.get("GAJIAN_SESSION_MAX_MB", "1024")) * 1024 * 1024)
+
+def get_session_frames():
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = SharedFrameStore.new_session_id()
+    return get_frame_store().session(st.session_state["session_id"])
+
+def get_payment_processor():
+    # Hasil pembayaran terakhir (stage "payment" di store); None jika belum dihitung atau sudah dibuang
+    if not st.session_state.get("payment_ready"):
+        return None
+    return get_session_frames().get("payment")
+
+def get_instrumentation():
+    if "instrumentation" not in st.session_state:
+        st.session_state["instrumentation"] = Instrumentation()
+    return st.session_state["instrumentation"]
+
+def get_pipeline():
+    if "pipeline" not in st.session_state:
+        st.session_state["pipeline"] = build_payment_pipeline(
+            harga_galian_lokal,
+            harga_galian_luar,
+            harga_samplingan_lokal,
+            harga_samplingan_luar,
+            store=get_session_frames(),
+            instrumentation=get_instrumentation(),
+            ledger=get_ledger(),
+            tariff_config=tariff_config,
+            drop_invalid=os.environ.get("GAJIAN_DROP_INVALID", "") == "1",
+            pricing_workers=PRICING_WORKERS,
+        )
+    # IUP (tarif + ledger) dan periode ledger dari Tab 3, supaya anomali, tarif, dan tanda "Sudah Dibayar"
+    # memakai IUP/bulan sesi ini (bulan yang sudah dicatat tidak ditandai terhadap dirinya sendiri)
+    pipeline = st.session_state["pipeline"]
+    pipeline.set_input("iup", get_session_iup())
+    pipeline.set_input("period", get_ledger_period())
+    return pipeline
+
+def show_scenario_panel(merged, current_tariffs):
+    # Bandingkan tarif saat ini dengan file tarif alternatif pada data stage 3 yang sama
+    with st.expander("🔀 What-if Tarif", expanded=False):
+        files = st.file_uploader(
+            "Upload file tarif JSON (satu file = satu skenario)", type=["json"],
+            accept_multiple_files=True, key="scenario_files"
+        )
+        if not files:
+            return
+        scenarios = {"saat ini": current_tariffs}
+        try:
+            for f in files:
+                name = os.path.splitext(f.name)[0]
+                scenarios[name] = TariffConfig(json.load(f), base_dir=".").resolve(get_session_iup())
+        except ValueError as e:
+            st.error(str(e))
+            return
+
+        result = evaluate_scenarios(merged, scenarios, get_instrumentation())
+        st.dataframe(result.total)
+        level = st.selectbox("Bandingkan per", ["prospek", "penggali"], key="scenario_level")
+        st.dataframe(result.compare(level))
+
+
+def show_performance_panel():
+    instrumentation = get_instrumentation()
+    with st.expander("⏱️ Performance", expanded=False):
+        if not instrumentation.records:
+            st.info("Belum ada stage yang dijalankan.")
+            return
+        metrics = instrumentation.to_frame()
+        metrics["memory_delta_mb"] = metrics["memory_delta_bytes"] / 2**20
+        st.dataframe(metrics.drop(columns=["memory_delta_bytes"]))
+        col1, col2 = st.columns(2)
+        col1.download_button(
+            label="⬇️ Download metrics JSON",
+            data=instrumentation.to_json().encode("utf-8"),
+            file_name="gajian_metrics.json",
+            mime="application/json",
+            key="download_metrics"
+        )
+        if col2.button("🧹 Reset metrics", key="reset_metrics"):
+            instrumentation.clear()
+
+        store = get_frame_store()
+        st.caption(
+            f"Memori DataFrame: sesi ini {get_session_frames().nbytes() / 2**20:.1f} MB, "
+            f"semua sesi {store.total_bytes() / 2**20:.1f} / {store.max_bytes / 2**20:.0f} MB"
+        )
+        st.dataframe(store.report())
 
 def main():
     st.title("🛠️ Gajian Configuration App")
     tab1, tab2, tab3 = st.tabs(["📄 Initialize", "🧱 Data Recap", "📦 Download Gajian"])
 
     var1 = None
-    var2 = None
 
     with tab1:
         st.header("📥 Inisialisasi")
@@ -43,94 +214,81 @@ def main():
         if uploaded_initial_file:
             try:
                 var1 = process_uploaded_csv(uploaded_initial_file)
-                var2 = ConfigurationInput()
-
-                if "stage1_result" not in st.session_state:
-                    st.session_state["stage1_result"] = var2.process_stage1(var1)
-                    st.session_state["stage2_result"] = None
-                    st.session_state["stage3_result"] = None
-                    st.session_state["merged_stage3"] = None
+                pipeline = get_pipeline()
+                pipeline.set_input("clean_data", var1, fingerprint=uploaded_initial_file.file_id)
 
                 st.success("✅ Data utama berhasil diproses.")
 
+                uploaded_file = st.file_uploader("Upload Template Lokasi dan Tanggal", type=["csv", "xlsx"])
+                stage1_df = None
+                if uploaded_file:
+                    try:
+                        stage1_df = read_location_template(uploaded_file, uploaded_file.name)
+                    except Exception as e:
+                        st.error(f"❌ Failed to read file: {e}")
+                pipeline.set_input("lokasi_template", stage1_df)
+
                 st.download_button(
                     label="⬇️ Download Template Lokasi dan Tanggal",
-                    data=convert_for_download(st.session_state["stage1_result"]),
+                    data=convert_for_download(pipeline.get("stage1")),
                     file_name="template_lokasi_dan_tanggal.csv",
                     mime="text/csv",
                     key="download_stage1"
                 )
 
-                uploaded_file = st.file_uploader("Upload Template Lokasi dan Tanggal", type=["csv", "xlsx"])
-                if uploaded_file:
-                    try:
-                        if uploaded_file.name.endswith(".csv"):
-                            stage1_df = pd.read_csv(uploaded_file)
-                        else:
-                            stage1_df = pd.read_excel(uploaded_file)
-
-                        date_cols = [
-                            "Tanggal Mulai (2025-05-23)",
-                            "Tanggal Selesai (2025-05-23)",
-                            "Tanggal Gajian (2025-05-23)"
-                        ]
-                        for col in date_cols:
-                            if col in stage1_df.columns:
-                                stage1_df[col] = pd.to_datetime(stage1_df[col], dayfirst=True, errors='coerce').dt.normalize()
-
-                        st.success("✅ Template berhasil diupload")
-                        st.dataframe(stage1_df)
-
-                        st.session_state["stage1_result"] = stage1_df
-                        st.session_state["stage2_result"] = var2.process_stage2(var1, stage1_df)
-                        st.session_state["stage3_result"] = var2.process_stage3(var1, stage1_df)
-                        st.session_state["merged_stage3"] = merge_stage3_with_stage2(
-                            st.session_state["stage3_result"],
-                            st.session_state["stage2_result"]
-                        )
-                    except Exception as e:
-                        st.error(f"❌ Failed to read file: {e}")
-                else:
+                if stage1_df is not None:
+                    st.success("✅ Template berhasil diupload")
+                    st.dataframe(stage1_df)
+                elif not uploaded_file:
                     st.info("Masih menggunakan data default.")
-                    if st.session_state["stage2_result"] is None:
-                        st.session_state["stage2_result"] = var2.process_stage2(var1, st.session_state["stage1_result"])
-                        st.session_state["stage3_result"] = var2.process_stage3(var1, st.session_state["stage1_result"])
-                        st.session_state["merged_stage3"] = merge_stage3_with_stage2(
-                            st.session_state["stage3_result"],
-                            st.session_state["stage2_result"]
-                        )
 
                 st.header("📦 Update data penggali")
-                if st.session_state["stage2_result"] is not None and not st.session_state["stage2_result"].empty:
-                    st.dataframe(st.session_state["stage2_result"])
+                stage2_default = pipeline.get("stage2")
+                if stage2_default is not None and not stage2_default.empty:
+                    st.dataframe(stage2_default)
 
                     st.download_button(
                         label="⬇️ Download template penggali",
-                        data=convert_for_download(st.session_state["stage2_result"]),
+                        data=convert_for_download(stage2_default),
                         file_name="template_penggali.csv",
                         mime="text/csv",
                         key="download_stage2"
                     )
 
                     uploaded_stage2 = st.file_uploader("📤 Upload template penggali", type=["csv"], key="upload_stage2")
+                    updated_stage2 = None
                     if uploaded_stage2 is not None:
                         try:
                             updated_stage2 = pd.read_csv(uploaded_stage2)
-                            st.session_state["stage2_result"] = updated_stage2
-                            st.session_state["merged_stage3"] = merge_stage3_with_stage2(
-                                st.session_state["stage3_result"],
-                                updated_stage2
-                            )
                             st.success("✅ Template penggali diperbarui.")
-                            st.dataframe(st.session_state["stage2_result"])
+                            st.dataframe(updated_stage2)
                         except Exception as e:
                             st.error(f"❌ Failed to read uploaded file: {e}")
+                    pipeline.set_input("penggali_template", updated_stage2)
                 else:
+                    pipeline.set_input("penggali_template", None)
                     st.warning("⚠️ Data template penggali tidak tersedia.")
 
+                # Hanya stage yang inputnya berubah yang dihitung ulang
+                merged = pipeline.get("merged")
+
                 st.header("🧪 Kelompok Data")
-                if st.session_state["merged_stage3"] is not None and not st.session_state["merged_stage3"].empty:
-                    st.dataframe(st.session_state["merged_stage3"])
+                if merged is not None and not merged.empty:
+                    st.dataframe(merged)
+
+                    # Dicek sebelum perhitungan tarif: duplikat dan nilai yang tidak cocok dengan aturan tarif
+                    anomalies = pipeline.get("anomalies")
+                    if len(anomalies):
+                        st.warning(f"⚠️ {len(anomalies)} anomali data ditemukan sebelum perhitungan.")
+                        with st.expander("🔎 Laporan anomali", expanded=False):
+                            st.dataframe(anomalies)
+                            st.download_button(
+                                label="⬇️ Download laporan anomali",
+                                data=convert_for_download(anomalies),
+                                file_name="anomalies.csv",
+                                mime="text/csv",
+                                key="download_anomalies"
+                            )
                 else:
                     st.warning("⚠️ Kelompok data belum tersedia.")
 
@@ -141,56 +299,72 @@ def main():
 
     with tab2:
         st.header("🧱 Data Recap")
-        if st.session_state.get("merged_stage3") is not None and not st.session_state["merged_stage3"].empty:
-            st.dataframe(st.session_state["merged_stage3"])
-
-            if st.button("▶️ Process Payment Calculation", key='Procces'):
-                processor = PaymentCount(
-                    harga_galian_lokal,
-                    harga_galian_luar,
-                    harga_samplingan_lokal,
-                    harga_samplingan_luar,
-                )
-                result_df = (
-                    processor
-                    .set_data(st.session_state["merged_stage3"])
-                    .harga_galian()
-                    .harga_samplingan()
-                    .harga_timbunan_dan_kompensasi_langsiran()
-                    .harga_angkutan()
-                    .get_result()
-                )
-
-                st.session_state["payment_result"] = result_df
-                st.session_state["payment_processor"] = processor
+        # Frame dibaca dari store bersama (read-only), tidak disalin ke session_state
+        merged = get_session_frames().get("merged")
+        if merged is not None and not merged.empty:
+            st.dataframe(merged)
+
+            job = get_job("payment")
+            running = job is not None and not job.finished
+            if st.button("▶️ Process Payment Calculation", key='Procces', disabled=running):
+                # Input stage (data + tanda ledger) disiapkan di sini, perhitungan tarif di thread latar belakang
+                pipeline = get_pipeline()
+                compute = pipeline.detach("payment")
+                rows = count_rows(pipeline.get("flagged")) or 0
+                job = get_job_runner().submit("payment", run_payment_job, compute, rows, instrumentation=get_instrumentation())
+                st.session_state["payment_job"] = job.id
+            show_job_status("payment", "Perhitungan gajian")
+            if collect_payment_job():
                 st.success("✅ Perhitungan gajian berhasil dilakukan.")
 
-            if "payment_result" in st.session_state:
+            payment_processor = get_payment_processor()
+            if payment_processor is not None:
+                if "Sudah Dibayar" in payment_processor.df.columns:
+                    already_paid = int(payment_processor.df["Sudah Dibayar"].notna().sum())
+                    if already_paid:
+                        st.warning(f"⚠️ {already_paid} testpit sudah pernah dibayar (lihat kolom 'Sudah Dibayar').")
+
                 st.subheader("💰 Payment Result")
-                st.dataframe(st.session_state["payment_result"])
+                st.dataframe(payment_processor.df)
 
                 st.download_button(
                     label="⬇️ Download Payment CSV",
-                    data=convert_for_download(st.session_state["payment_result"]),
+                    data=convert_for_download(payment_processor.df),
                     file_name="payment_result.csv",
                     mime="text/csv",
                     key="procces2"
                 )
 
-                payment_processor = st.session_state.get("payment_processor")
-                if payment_processor is not None:
-                    pivot_df = payment_processor.get_pivot_summary()
+                # Rollup disimpan di processor, jadi rerun hanya memilih tabel yang sudah ada
+                rollup = payment_processor.get_rollup()
+                pivot_df = rollup.summary_table()
+
+                if not pivot_df.empty:
+                    st.subheader("📊 Rekap Total Pembayaran per TPID")
+                    st.dataframe(pivot_df)
 
-                    if not pivot_df.empty:
-                        st.subheader("📊 Rekap Total Pembayaran per TPID")
-                        st.dataframe(pivot_df)
+                    st.download_button(
+                        label="⬇️ Download Rekap Pembayaran per TPID",
+                        data=convert_for_download(pivot_df),
+                        file_name="rekap_pembayaran_per_tpid.csv",
+                        mime="text/csv"
+                    )
 
-                        st.download_button(
-                            label="⬇️ Download Rekap Pembayaran per TPID",
-                            data=pivot_df.to_csv(index=False).encode("utf-8"),
-                            file_name="rekap_pembayaran_per_tpid.csv",
-                            mime="text/csv"
-                        )
+                    level_labels = {
+                        "prospek": "Prospek",
+                        "penggali": "Penggali",
+                        "pemilik": "Pemilik Lahan",
+                        "tanggal": "Tanggal Sampling",
+                    }
+                    level = st.selectbox(
+                        "📈 Rekap total per",
+                        list(level_labels),
+                        format_func=level_labels.get,
+                        key="rollup_level"
+                    )
+                    st.dataframe(rollup.by(level))
+
+                show_scenario_panel(merged, payment_processor.tariffs)
         else:
             st.info("Silakan unggah data di Tab 1 terlebih dahulu.")
 
@@ -198,13 +372,13 @@ def main():
         st.header("📦 Download Gajian")
 
         st.markdown("### Tanggal Gajian")
-        date_input = st.date_input("Tanggal Dokumen", value=None)
+        date_input = st.date_input("Tanggal Dokumen", value=None, key="date_input")
         location_input = st.text_input("Lokasi", value="Setabar")
 
         date_text = f"{location_input}, {date_input.strftime('%d %B %Y')}" if date_input else ""
 
         st.markdown("### IUP")
-        iup = st.text_input("IUP", value="BEST")
+        iup = st.text_input("IUP", value=DEFAULT_IUP, key="iup")
 
         st.markdown("### Penandatangan")
         signer_b_name = st.text_input("Admin - Nama", value="Chandra Ardiansyah")
@@ -218,24 +392,37 @@ def main():
             "D": (signer_d_name, signer_d_title),
         }
 
-        df = st.session_state.get("payment_result")
+        payment_processor = get_payment_processor()
 
-        if df is not None:
-            df["Tanggal Sampling"] = pd.to_datetime(df["Tanggal Sampling"], errors='coerce')
-            df["Tanggal Sampling"] = df["Tanggal Sampling"].dt.strftime('%Y-%m-%d')
+        if payment_processor is not None:
+            df = payment_processor.df
             output_file = f'Gajian IUP OP {iup} {date_text}.xlsx'
 
-            if st.button("Generate Excel", key="asd"):
-                builder = PaymentExcelBuilder(df)
-                builder.create_multi_payment_excel(
-                    output_file=output_file,
-                    date_text=date_text,
-                    signers=signers
+            job = get_job("excel")
+            if st.button("Generate Excel", key="asd", disabled=job is not None and not job.finished):
+                # Tanggal Sampling tetap datetime sampai ke Excel; frame di store dipakai apa adanya (read-only)
+                # Kunci job: sidik jari data + date_text + signers; workbook yang sama tidak dirender ulang
+                key = ("excel", fingerprint_frame(df), date_text, tuple(sorted(signers.items())))
+                job = get_job_runner().submit(
+                    "excel", run_excel_job, df, date_text, signers, get_instrumentation(),
+                    key=key, instrumentation=get_instrumentation()
                 )
-                with open(output_file, "rb") as f:
-                    st.download_button("Download Excel", f, file_name=output_file)
+                st.session_state["excel_job"] = job.id
+                st.session_state["excel_file"] = output_file
+            show_job_status("excel", "Render Excel")
+            if job is not None and job.status == "done":
+                st.download_button("Download Excel", job.result, file_name=st.session_state.get("excel_file", output_file))
+
+            ledger = get_ledger()
+            if ledger is not None and date_input:
+                period = get_ledger_period()
+                if st.button(f"📒 Catat ke ledger ({iup} {period})", key="record_ledger"):
+                    recorded = ledger.record(df, period, iup)
+                    st.success(f"✅ {recorded} testpit dicatat di ledger.")
         else:
             st.warning("⚠️ Harap lakukan proses pembayaran di Tab 2 terlebih dahulu.")
 
+    show_performance_panel()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,183 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from modul import ConfigurationInput, DataFilterAndSelect, PaymentCount, PaymentExcelBuilder
+from pipeline import load_price_tables, merge_stage3_with_stage2
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+
+
+def generate_volker_export(n_rows, n_prospek=None, seed=0, extra_columns=20, price_tables=None):
+    # Export Volker sintetis: skema DataFilterAndSelect.COLUMNS + kolom tambahan yang tidak dipakai.
+    # Kedalaman dan koli diambil dari kunci tabel hg_galian_* / hg_samplingan_* (lokal dan luar),
+    # supaya setiap baris melewati lookup harga yang sebenarnya.
+    rng = np.random.default_rng(seed)
+    if price_tables is None:
+        price_tables = load_price_tables(os.path.dirname(os.path.abspath(__file__)))
+    galian_lokal, galian_luar, samplingan_lokal, samplingan_luar = price_tables
+    depth_keys = np.intersect1d(galian_lokal.keys, galian_luar.keys)
+    koli_keys = np.intersect1d(samplingan_lokal.keys, samplingan_luar.keys)
+    n_prospek = n_prospek or max(5, min(2_000, n_rows // 500))
+    n_penggali = max(10, n_prospek * 3)
+
+    prospek = np.array([f"PRS-{i:04d}" for i in range(n_prospek)])
+    penggali = np.array([f"Penggali {i:04d}" for i in range(n_penggali)])
+    pemilik = np.array([f"Pemilik Lahan {i:05d}" for i in range(max(20, n_rows // 20))])
+    grid = np.array([f"G{i:03d}" for i in range(200)])
+
+    depth = rng.choice(depth_keys, n_rows)
+    depth[rng.random(n_rows) < 0.02] = np.nan
+    dates = pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 180, n_rows), unit="D")
+
+    df = pd.DataFrame({
+        "Kode Testpit": [f"TP{i:08d}" for i in range(n_rows)],
+        "Grid": rng.choice(grid, n_rows),
+        "Prospek": rng.choice(prospek, n_rows),
+        "Tanggal Sampling": dates.strftime("%d/%m/%Y"),
+        "Total Kedalaman": depth,
+        "Total Koli": rng.choice(koli_keys, n_rows).astype("int64"),
+        "Pemilik Lahan": rng.choice(pemilik, n_rows),
+        "Penggali": rng.choice(penggali, n_rows),
+        "Pengangkut": rng.integers(0, 4, n_rows),
+        "Penimbun": rng.integers(0, 3, n_rows),
+    })
+    for i in range(extra_columns):
+        df[f"Kolom Lain {i}"] = rng.random(n_rows).round(3)
+    return df
+
+
+def generate_templates(clean_data, stage2_data, seed=0):
+    # Template lokasi: jendela tanggal untuk semua lokasi; template penggali: pilihan lokal/luar acak
+    rng = np.random.default_rng(seed)
+    stage1 = ConfigurationInput().process_stage1(clean_data)
+    stage1["Tanggal Mulai (2025-05-23)"] = pd.Timestamp("2025-01-15")
+    stage1["Tanggal Selesai (2025-05-23)"] = pd.Timestamp("2025-06-15")
+    stage1["Sistem Angkutan (Koli/Kilo)"] = rng.choice(["Koli", "Kilo"], len(stage1))
+
+    stage2 = stage2_data.copy()
+    stage2["Kelompok Penggali"] = rng.choice(["A", "B", "C", "D"], len(stage2))
+    stage2["Harga Galian (Lokal/Luar)"] = rng.choice(["Lokal", "Luar"], len(stage2))
+    stage2["Harga Samplingan (Lokal/Luar)"] = rng.choice(["Lokal", "Luar"], len(stage2))
+    return stage1, stage2
+
+
+class StageTimer:
+    def __init__(self, size, track_memory=True):
+        self.size = size
+        self.track_memory = track_memory
+        self.records = []
+        self.failed = False
+
+    def run(self, stage, func, rows_in=None):
+        # Jalankan satu stage; setelah ada stage gagal, stage berikutnya dilewati
+        record = {"size": self.size, "stage": stage, "rows_in": rows_in}
+        if self.failed:
+            record["status"] = "skipped"
+            self.records.append(record)
+            return None
+
+        gc.collect()
+        if self.track_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            result = func()
+            record["status"] = "ok"
+        except Exception as e:  # termasuk MemoryError
+            result = None
+            record.update(status="error", error=f"{type(e).__name__}: {e}")
+            self.failed = True
+        record["seconds"] = round(time.perf_counter() - started, 4)
+        if self.track_memory:
+            record["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if isinstance(result, pd.DataFrame):
+            record["rows_out"] = len(result)
+
+        self.records.append(record)
+        print(f"  {stage:<55} {record['status']:<7} {record.get('seconds', 0):>9.3f} s"
+              + (f" {record['peak_bytes'] / 2**20:>9.1f} MB" if "peak_bytes" in record else ""))
+        return result
+
+
+def run_benchmark(size, workdir, track_memory=True, excel=True, seed=0):
+    timer = StageTimer(size, track_memory)
+    price_tables = load_price_tables(os.path.dirname(os.path.abspath(__file__)))
+
+    csv_path = os.path.join(workdir, f"volker_{size}.csv")
+    generate_volker_export(size, seed=seed, price_tables=price_tables).to_csv(csv_path, index=False)
+
+    clean = timer.run("csv_load_and_filter", lambda: DataFilterAndSelect.from_csv(csv_path).filter_and_select(), size)
+    config = ConfigurationInput()
+    timer.run("process_stage1", lambda: config.process_stage1(clean), len(clean) if clean is not None else None)
+    if timer.failed:
+        return timer.records
+
+    stage1, _ = generate_templates(clean, pd.DataFrame(columns=["Penggali"]), seed)
+    stage2 = timer.run("process_stage2", lambda: config.process_stage2(clean, stage1), len(clean))
+    stage3 = timer.run("process_stage3", lambda: config.process_stage3(clean, stage1), len(clean))
+    if timer.failed:
+        return timer.records
+
+    _, penggali = generate_templates(clean, stage2, seed)
+    merged = timer.run("merge_stage3_with_stage2", lambda: merge_stage3_with_stage2(stage3, penggali), len(stage3))
+
+    processor = PaymentCount(*price_tables)
+    rows = len(merged) if merged is not None else None
+    timer.run("PaymentCount.set_data", lambda: processor.set_data(merged).df, rows)
+    for step in ("harga_galian", "harga_samplingan", "harga_timbunan_dan_kompensasi_langsiran", "harga_angkutan"):
+        timer.run(f"PaymentCount.{step}", lambda step=step: getattr(processor, step)().df, rows)
+    result = timer.run("PaymentCount.get_result", processor.get_result, rows)
+    timer.run("PaymentCount.get_pivot_summary", processor.get_pivot_summary, rows)
+
+    if excel:
+        excel_path = os.path.join(workdir, f"gajian_{size}.xlsx")
+        timer.run(
+            "create_multi_payment_excel",
+            lambda: PaymentExcelBuilder(result).create_multi_payment_excel(excel_path, streaming=True),
+            len(result) if result is not None else None,
+        )
+    return timer.records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pipeline gajian dengan export Volker sintetis.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Jumlah baris export")
+    parser.add_argument("--output", default="bench_results.jsonl", help="Hasil JSON Lines (ditambahkan)")
+    parser.add_argument("--no-memory", action="store_true", help="Tanpa tracemalloc (waktu lebih akurat)")
+    parser.add_argument("--no-excel", action="store_true", help="Lewati create_multi_payment_excel")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    environment = {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+    run_id = time.strftime("%Y%m%dT%H%M%S")
+
+    with tempfile.TemporaryDirectory() as workdir, open(args.output, "a", encoding="utf-8") as out:
+        for size in args.sizes:
+            print(f"▶️ {size} baris")
+            records = run_benchmark(size, workdir, track_memory=not args.no_memory,
+                                    excel=not args.no_excel, seed=args.seed)
+            for record in records:
+                out.write(json.dumps({"run_id": run_id, **environment, **record}) + "\n")
+            out.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def fingerprint_frame(df, *parts) -> str:
+    # Sidik jari isi DataFrame (nilai, kolom, tipe) ditambah parameter lain yang mempengaruhi hasil
+    digest = hashlib.sha256()
+    digest.update(repr(list(df.columns)).encode("utf-8"))
+    digest.update(repr([str(dtype) for dtype in df.dtypes]).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    for part in parts:
+        digest.update(b"\0")
+        digest.update(repr(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class DiskCache:
+    # Cache di disk yang dialamatkan dengan hash isi; ukuran dibatasi dengan eviksi LRU
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def content_key(data: bytes, *parts) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode("utf-8"))
+            digest.update(b"\0")
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key, suffix):
+        return self.directory / f"{key}{suffix}"
+
+    def _touch(self, path):
+        # mtime dipakai sebagai waktu akses terakhir (atime tidak selalu aktif)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _write(self, path, write):
+        # Tulis ke file sementara lalu rename, supaya proses lain tidak membaca file setengah jadi
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp_name)
+            os.replace(tmp_name, path)
+        except Exception:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        self.evict()
+
+    def get_frame(self, key):
+        path = self._path(key, ".parquet")
+        if not path.exists():
+            return None
+        try:
+            df = pd.read_parquet(path)
+        except Exception:
+            # File rusak dianggap miss dan dibuang
+            path.unlink(missing_ok=True)
+            return None
+        self._touch(path)
+
+        # Parquet mengembalikan None untuk teks kosong; samakan dengan hasil read_csv (NaN)
+        for col in df.select_dtypes(include="object").columns:
+            df[col] = df[col].where(df[col].notna(), np.nan)
+        return df
+
+    def put_frame(self, key, df):
+        self._write(self._path(key, ".parquet"), lambda name: df.to_parquet(name, index=False))
+
+    def entries(self):
+        files = []
+        for path in self.directory.iterdir():
+            if path.suffix == ".tmp" or not path.is_file():
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        files = sorted(self.entries(), key=lambda entry: entry[0])
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
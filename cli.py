@@ -0,0 +1,273 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from instrumentation import Instrumentation
+from ledger import PaymentLedger
+from modul import DataFilterAndSelect, PaymentExcelBuilder
+from pipeline import build_payment_pipeline, load_price_tables, load_tariffs, read_location_template
+from scenario import evaluate_scenarios
+from tarif import TariffConfig
+
+DEFAULT_SIGNERS = {
+    "B": ("Chandra Ardiansyah", "Keu. / Umum"),
+    "D": ("Rizky Lambas", "Geologist"),
+}
+
+
+def _set_inputs(pipeline, job, instrumentation):
+    source = DataFilterAndSelect.from_csv(job["data"], engine=job.get("engine", "c"), instrumentation=instrumentation)
+    pipeline.set_input("clean_data", source.filter_and_select())
+    pipeline.set_input("lokasi_template", read_location_template(job["lokasi"], job["lokasi"]))
+    pipeline.set_input("penggali_template", pd.read_csv(job["penggali"]) if job.get("penggali") else None)
+    return source
+
+
+def run_scenarios(job, tarif_files):
+    # Data stage 3 yang sama dihitung dengan setiap file tarif sekaligus; nama skenario = nama file
+    iup = job.get("iup")
+    scenarios = {}
+    for path in tarif_files:
+        name = os.path.splitext(os.path.basename(path))[0]
+        # Nama skenario harus unik; file bernama sama di folder lain akan saling menimpa
+        if name in scenarios:
+            raise ValueError(f"Duplicate scenario name '{name}' from {path}; rename one of the tariff files")
+        scenarios[name] = TariffConfig.load(path).resolve(iup)
+
+    os.makedirs(job["out"], exist_ok=True)
+    instrumentation = Instrumentation()
+    pipeline = build_payment_pipeline(instrumentation=instrumentation, tariffs=scenarios[next(iter(scenarios))])
+    _set_inputs(pipeline, job, instrumentation)
+    result = evaluate_scenarios(pipeline.get("merged"), scenarios, instrumentation)
+    result.total.to_csv(os.path.join(job["out"], "skenario_total.csv"), index=False)
+    for level in ("prospek", "penggali"):
+        result.compare(level).to_csv(os.path.join(job["out"], f"skenario_per_{level}.csv"), index=False)
+    return result
+
+
+def run_job(job):
+    # Satu job = satu IUP/periode: Volker CSV + template lokasi + template penggali -> CSV, rekap, xlsx
+    started = time.perf_counter()
+    out_dir = job["out"]
+    os.makedirs(out_dir, exist_ok=True)
+
+    iup = job.get("iup", "BEST")
+    period = job.get("period") or job.get("date_text", "")
+    ledger = PaymentLedger(job["ledger"]) if job.get("ledger") else None
+
+    instrumentation = Instrumentation()
+    pipeline = build_payment_pipeline(
+        *load_price_tables(job.get("prices_dir", ".")),
+        tariffs=load_tariffs(job.get("tarif"), iup),
+        instrumentation=instrumentation,
+        delta_store=job.get("delta_store"),
+        ledger=ledger,
+        period=period,
+        iup=iup,
+        drop_invalid=job.get("drop_invalid", False),
+        pricing_workers=job.get("pricing_workers", 1)
+    )
+    source = _set_inputs(pipeline, job, instrumentation)
+    source.memory_report.to_csv(os.path.join(out_dir, "memory_report.csv"), index=False)
+
+    anomalies = pipeline.get("anomalies")
+    anomalies.to_csv(os.path.join(out_dir, "anomalies.csv"), index=False)
+
+    processor = pipeline.get("payment")
+    result_df = processor.df
+    result_df.to_csv(os.path.join(out_dir, "payment_result.csv"), index=False)
+    rollup = processor.get_rollup()
+    rollup.summary_table().to_csv(os.path.join(out_dir, "rekap_pembayaran_per_tpid.csv"), index=False)
+    for level, frame in rollup.totals.items():
+        frame.to_csv(os.path.join(out_dir, f"rekap_pembayaran_per_{level}.csv"), index=False)
+
+    date_text = job.get("date_text", "")
+    signers = {key: tuple(value) for key, value in job.get("signers", DEFAULT_SIGNERS).items()}
+    excel_file = os.path.join(out_dir, f"Gajian IUP OP {iup} {date_text}.xlsx")
+    PaymentExcelBuilder(result_df, instrumentation).create_multi_payment_excel(
+        excel_file,
+        date_text=date_text,
+        signers=signers,
+        streaming=True,
+        workers=job.get("excel_workers", 1)
+    )
+
+    already_paid = 0
+    if ledger is not None:
+        already_paid = int(result_df["Sudah Dibayar"].notna().sum()) if "Sudah Dibayar" in result_df.columns else 0
+        ledger.record(result_df, period, iup)
+
+    # Metrik per stage untuk monitoring
+    metrics_file = os.path.join(out_dir, "metrics.json")
+    with open(metrics_file, "w", encoding="utf-8") as f:
+        f.write(instrumentation.to_json())
+
+    return {
+        "name": job.get("name", iup),
+        "rows": len(result_df),
+        "excel": excel_file,
+        "metrics": metrics_file,
+        "already_paid": already_paid,
+        "anomalies": len(anomalies),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def load_manifest(path):
+    # Manifest JSON: {"defaults": {...}, "jobs": [{...}, ...]} atau langsung list job.
+    # Path relatif dihitung dari folder manifest.
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"jobs": manifest}
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for entry in manifest.get("jobs", []):
+        job = {**manifest.get("defaults", {}), **entry}
+        for key in ("data", "lokasi", "penggali", "out", "prices_dir", "delta_store", "ledger", "tarif"):
+            if job.get(key) and not os.path.isabs(job[key]):
+                job[key] = os.path.join(base_dir, job[key])
+        missing = [key for key in ("data", "lokasi", "out") if not job.get(key)]
+        if missing:
+            raise ValueError(f"Job '{job.get('name', '?')}' is missing: {', '.join(missing)}")
+        jobs.append(job)
+    return jobs
+
+
+def run_batch(jobs, workers=None):
+    results, failures = [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_job, job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            name = job.get("name", job.get("iup", job["out"]))
+            try:
+                summary = future.result()
+                results.append(summary)
+                print(f"✅ {name}: {summary['rows']} testpit, {summary['seconds']} s -> {summary['excel']}")
+            except Exception as e:
+                failures.append(name)
+                print(f"❌ {name} gagal: {e}", file=sys.stderr)
+    return results, failures
+
+
+def _signers_from_args(args):
+    signers = dict(DEFAULT_SIGNERS)
+    for key, value in (("B", args.signer_b), ("D", args.signer_d)):
+        if value:
+            name, _, title = value.partition("|")
+            signers[key] = (name.strip(), title.strip())
+    return signers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hitung gajian tanpa Streamlit (satu job atau batch manifest).")
+    parser.add_argument("-v", "--verbose", action="count", default=0, help="Log durasi stage (-vv: per lokasi)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Proses satu Volker CSV")
+    run.add_argument("--data", required=True, help="CSV UTF-8 export Volker")
+    run.add_argument("--lokasi", required=True, help="Template lokasi dan tanggal (csv/xlsx)")
+    run.add_argument("--penggali", help="Template penggali (csv)")
+    run.add_argument("--out", required=True, help="Folder output")
+    run.add_argument("--iup", default="BEST")
+    run.add_argument("--date-text", default="", help='Mis. "Setabar, 26 Juni 2025"')
+    run.add_argument("--signer-b", help='Admin, format "Nama|Jabatan"')
+    run.add_argument("--signer-d", help='Geos, format "Nama|Jabatan"')
+    run.add_argument("--prices-dir", default=".", help="Folder CSV hg_*")
+    run.add_argument("--tarif", help="Konfigurasi tarif JSON (mis. tarif.json); menggantikan CSV hg_* dan tarif bawaan")
+    run.add_argument("--engine", choices=["c", "pyarrow"], default="c")
+    run.add_argument("--excel-workers", type=int, default=1)
+    run.add_argument("--pricing-workers", type=int, default=1, help="Proses untuk perhitungan tarif (data besar)")
+    run.add_argument("--delta-store", help="Folder hasil testpit sebelumnya; hanya testpit baru/berubah yang dihitung")
+    run.add_argument("--ledger", help="File SQLite ledger pembayaran; hasil dicatat dan testpit yang sudah dibayar ditandai")
+    run.add_argument("--period", help="Periode gaji untuk ledger, mis. 2025-06 (default: --date-text)")
+    run.add_argument("--drop-invalid", action="store_true", help="Baris dengan anomali (anomalies.csv) tidak dihitung")
+
+    batch = sub.add_parser("batch", help="Proses banyak job dari manifest JSON secara paralel")
+    batch.add_argument("manifest")
+    batch.add_argument("--workers", type=int, default=None, help="Jumlah proses (default: jumlah core)")
+
+    what_if = sub.add_parser("scenario", help="Bandingkan beberapa file tarif pada data yang sama")
+    what_if.add_argument("--data", required=True, help="CSV UTF-8 export Volker")
+    what_if.add_argument("--lokasi", required=True, help="Template lokasi dan tanggal (csv/xlsx)")
+    what_if.add_argument("--penggali", help="Template penggali (csv)")
+    what_if.add_argument("--tarif", required=True, action="append", help="File tarif JSON (ulangi untuk tiap skenario)")
+    what_if.add_argument("--iup", help="IUP untuk override tarif per IUP")
+    what_if.add_argument("--out", required=True, help="Folder output")
+    what_if.add_argument("--engine", choices=["c", "pyarrow"], default="c")
+
+    query = sub.add_parser("ledger", help="Cari di ledger pembayaran")
+    query.add_argument("ledger", help="File SQLite ledger")
+    query.add_argument("--testpit", help="Riwayat pembayaran satu Kode Testpit")
+    query.add_argument("--by", choices=["penggali", "pemilik_lahan", "prospek"], default="penggali")
+    query.add_argument("--name", help="Nama penggali/pemilik/prospek")
+    query.add_argument("--from", dest="start_period", help="Periode awal (inklusif)")
+    query.add_argument("--to", dest="end_period", help="Periode akhir (inklusif)")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=[logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)],
+        format="%(asctime)s %(name)s %(levelname)s %(message)s",
+    )
+
+    if args.command == "run":
+        summary = run_job({
+            "data": args.data,
+            "lokasi": args.lokasi,
+            "penggali": args.penggali,
+            "out": args.out,
+            "iup": args.iup,
+            "date_text": args.date_text,
+            "signers": _signers_from_args(args),
+            "prices_dir": args.prices_dir,
+            "tarif": args.tarif,
+            "engine": args.engine,
+            "excel_workers": args.excel_workers,
+            "pricing_workers": args.pricing_workers,
+            "delta_store": args.delta_store,
+            "ledger": args.ledger,
+            "period": args.period,
+            "drop_invalid": args.drop_invalid,
+        })
+        print(f"✅ {summary['rows']} testpit, {summary['seconds']} s -> {summary['excel']}")
+        if summary["anomalies"]:
+            print(f"⚠️ {summary['anomalies']} anomali data (lihat anomalies.csv)")
+        if summary["already_paid"]:
+            print(f"⚠️ {summary['already_paid']} testpit sudah dibayar di periode lain (kolom 'Sudah Dibayar')")
+        return 0
+
+    if args.command == "scenario":
+        result = run_scenarios({
+            "data": args.data,
+            "lokasi": args.lokasi,
+            "penggali": args.penggali,
+            "out": args.out,
+            "iup": args.iup,
+            "engine": args.engine,
+        }, args.tarif)
+        print(result.total.to_string(index=False))
+        return 0
+
+    if args.command == "ledger":
+        ledger = PaymentLedger(args.ledger)
+        if args.testpit:
+            table = ledger.testpit_history(args.testpit)
+        else:
+            table = ledger.earnings(args.by, args.start_period, args.end_period, args.name)
+        print(table.to_string(index=False))
+        return 0
+
+    _, failures = run_batch(load_manifest(args.manifest), workers=args.workers)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import logging
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Format yang dicoba saat mendeteksi dari sampel; urutan = prioritas jika sama banyak cocoknya.
+# Hanya urutan hari-dulu (dayfirst) seperti export Volker dan template lokasi.
+DATE_FORMATS = [
+    "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d", "%Y/%m/%d",
+    "%d/%m/%Y %H:%M", "%d/%m/%Y %H:%M:%S", "%d-%m-%Y %H:%M:%S", "%Y-%m-%d %H:%M:%S",
+    "%d/%m/%y", "%d %B %Y", "%d %b %Y",
+]
+logger = logging.getLogger(__name__)
+
+SAMPLE_SIZE = 200
+CACHE_MAX = 200_000
+
+# Teks tanggal -> datetime64[ns], dipakai bersama semua upload/sesi (tanggal yang sama berulang terus)
+_cache = {}
+_lock = threading.Lock()
+
+
+def _try_format(texts, fmt):
+    return pd.to_datetime(pd.Series(texts, dtype=object), format=fmt, errors="coerce").to_numpy(dtype="datetime64[ns]")
+
+
+def detect_format(texts, formats=DATE_FORMATS):
+    # Format yang paling banyak cocok pada sampel nilai unik; None jika tidak ada yang cocok
+    sample = list(texts[:SAMPLE_SIZE])
+    if not sample:
+        return None
+    best, best_count = None, 0
+    for fmt in formats:
+        count = int((~np.isnat(_try_format(sample, fmt))).sum())
+        if count > best_count:
+            best, best_count = fmt, count
+        if count == len(sample):
+            break
+    return best
+
+
+def _parse_texts(texts):
+    # Format terdeteksi untuk semua teks; sisanya dicoba dengan format kandidat lain (ketat), lalu teks
+    # yang masih gagal (mis. ISO dengan "T", detik pecahan) diparse per elemen dengan dayfirst seperti
+    # pd.to_datetime lama. Hanya teks yang tidak bisa dibaca sama sekali -> NaT.
+    parsed = np.full(len(texts), np.datetime64("NaT"), dtype="datetime64[ns]")
+    fmt = detect_format(texts)
+    if fmt is not None:
+        parsed[:] = _try_format(texts, fmt)
+        for other in DATE_FORMATS:
+            pending = np.flatnonzero(np.isnat(parsed))
+            if len(pending) == 0:
+                break
+            if other != fmt:
+                parsed[pending] = _try_format([texts[i] for i in pending], other)
+
+    pending = np.flatnonzero(np.isnat(parsed))
+    if len(pending):
+        parsed[pending] = pd.to_datetime(
+            pd.Series([texts[i] for i in pending], dtype=object), format="mixed", dayfirst=True, errors="coerce"
+        ).to_numpy(dtype="datetime64[ns]")
+    return parsed
+
+
+def parse_dates(values, normalize=False):
+    # Kolom tanggal (teks/objek) -> Series datetime64[ns] dengan index yang sama. Hanya nilai unik yang
+    # diparse, hasilnya disimpan di cache dan dipetakan balik lewat kode factorize. Gagal -> NaT.
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        result = series.astype("datetime64[ns]")
+        return result.dt.normalize() if normalize else result
+
+    codes, uniques = pd.factorize(series)
+    uniques = list(uniques)
+    parsed = np.full(len(uniques) + 1, np.datetime64("NaT"), dtype="datetime64[ns]")  # posisi -1 = NaT
+
+    texts, text_positions = [], []
+    with _lock:
+        for i, value in enumerate(uniques):
+            if isinstance(value, (datetime, np.datetime64)):
+                parsed[i] = pd.Timestamp(value).to_datetime64()
+                continue
+            text = str(value).strip()
+            cached = _cache.get(text)
+            if cached is not None:
+                parsed[i] = cached
+            elif text:
+                texts.append(text)
+                text_positions.append(i)
+
+    if texts:
+        fresh = _parse_texts(texts)
+        parsed[text_positions] = fresh
+        failed = [text for text, value in zip(texts, fresh) if np.isnat(value)]
+        if failed:
+            rows = int(np.isin(codes, np.asarray(text_positions)[np.isnat(fresh)]).sum())
+            logger.warning("%s: %d rows (%d distinct values) are not valid dates, e.g. %r",
+                           series.name, rows, len(failed), failed[:3])
+        with _lock:
+            if len(_cache) + len(texts) > CACHE_MAX:
+                _cache.clear()
+            # Teks gagal tidak disimpan, supaya peringatannya muncul lagi di upload berikutnya
+            _cache.update((text, value) for text, value in zip(texts, fresh) if not np.isnat(value))
+
+    if normalize:
+        parsed = parsed.astype("datetime64[D]").astype("datetime64[ns]")
+    return pd.Series(parsed[codes], index=series.index, name=series.name)
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ledger import PAID_COLUMN
+from modul import PaymentCount
+from tarif import CATEGORIES, tariff_column
+
+logger = logging.getLogger(__name__)
+
+KEY = "Kode Testpit"
+ROW_HASH = "_row_hash"
+# Kolom tanda yang ditambahkan setelah merge; tidak mempengaruhi tarif, jadi tidak ikut di-hash
+ANNOTATION_COLUMNS = [PAID_COLUMN]
+
+
+def row_hashes(df):
+    # Hash per baris atas semua kolom input; kategori di-hash sesuai nilainya, jadi sama dengan teks biasa
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+class PricedStore:
+    # Testpit yang sudah dihitung dari run sebelumnya: Kode Testpit, hash baris input, dan kolom tarif.
+    # Satu store per kampanye/IUP; meta.json mencatat sidik jari tarif dan kolom input.
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.data_path = self.directory / "priced.parquet"
+        self.meta_path = self.directory / "meta.json"
+
+    def load(self, tarif_fingerprint, columns):
+        # Store dengan tarif atau kolom input berbeda dianggap kosong (semua baris dihitung ulang)
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("tarif_fingerprint") != tarif_fingerprint or meta.get("columns") != list(map(str, columns)):
+                return None
+            return pd.read_parquet(self.data_path)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, priced, tarif_fingerprint, columns):
+        self._write(self.data_path, lambda name: priced.to_parquet(name, index=False))
+        meta = {
+            "tarif_fingerprint": tarif_fingerprint,
+            "columns": list(map(str, columns)),
+            "rows": len(priced),
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        self._write(self.meta_path, lambda name: Path(name).write_text(json.dumps(meta, indent=2), encoding="utf-8"))
+
+    def _write(self, path, write):
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp_name)
+            os.replace(tmp_name, path)
+        except Exception:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+
+
+def price_incremental(processor: PaymentCount, merged, store: PricedStore):
+    # Hanya testpit baru atau yang inputnya berubah yang dihitung lewat PaymentCount; sisanya diambil
+    # dari store. Hasil sama dengan perhitungan penuh + get_result (duplikat dibuang lebih dulu, karena
+    # tarif dihitung per baris dan get_result menyimpan baris pertama per Kode Testpit).
+    if KEY not in merged.columns:
+        processor.set_data(merged).price().get_result()
+        return processor
+
+    with processor.instrumentation.stage("delta.price_incremental", rows_in=len(merged)) as record:
+        current = merged.drop_duplicates(subset=[KEY]).reset_index(drop=True)
+        # Hanya kolom input tarif: tanda "Sudah Dibayar" berubah setelah pencatatan ledger, tapi tarifnya tidak
+        columns = [col for col in current.columns if col not in ANNOTATION_COLUMNS]
+        fingerprint = processor.tarif_fingerprint()
+        hashes = row_hashes(current[columns])
+
+        previous = store.load(fingerprint, columns)
+        reuse = np.zeros(len(current), dtype=bool)
+        stored_rows = np.full(len(current), -1)
+        if previous is not None and len(previous):
+            lookup = pd.Series(np.arange(len(previous)), index=pd.MultiIndex.from_arrays(
+                [previous[KEY].astype(object), previous[ROW_HASH].to_numpy()]))
+            keys = pd.MultiIndex.from_arrays([current[KEY].astype(object), hashes])
+            stored_rows = lookup.reindex(keys).fillna(-1).to_numpy(dtype="int64")
+            reuse = stored_rows >= 0
+
+        fresh = current.loc[~reuse]
+        if len(fresh):
+            processor.set_data(fresh).price()
+            priced = processor.df
+        else:
+            priced = fresh
+
+        result = current.copy(deep=False)
+        for category, col in CATEGORIES.items():
+            in_fresh = col in priced.columns
+            in_store = previous is not None and col in previous.columns and reuse.any()
+            if not in_fresh and not in_store:
+                continue
+            values = np.full(len(current), np.nan)
+            if in_fresh:
+                values[~reuse] = pd.to_numeric(priced[col], errors="coerce").to_numpy(dtype="float64")
+            if in_store:
+                values[reuse] = previous[col].to_numpy(dtype="float64")[stored_rows[reuse]]
+            # Tipe ditentukan seperti perhitungan penuh (aturan integer + tidak ada NaN di baris hari ini),
+            # bukan dari tipe kolom store yang bisa float karena NaN di testpit lain
+            result[col] = tariff_column(values, processor.tariffs.integer(category, current))
+
+        # Testpit lama yang tidak ada di export hari ini tetap disimpan
+        tarif_cols = [col for col in PaymentCount.TARIF_COLUMNS if col in result.columns]
+        updated = result[[KEY] + tarif_cols].assign(**{ROW_HASH: hashes})
+        if previous is not None and len(previous):
+            kept = previous[~previous[KEY].isin(current[KEY])]
+            updated = pd.concat([kept.reindex(columns=updated.columns), updated], ignore_index=True)
+        store.save(updated, fingerprint, columns)
+
+        processor.set_data(result)
+        record["rows_out"] = len(result)
+        record["reused"] = int(reuse.sum())
+        record["priced"] = int((~reuse).sum())
+        logger.info("delta: %d testpit reused, %d priced", record["reused"], record["priced"])
+    return processor
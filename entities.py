@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+# Kolom nama bebas yang diperlakukan sebagai entitas (join, filter, dan groupby memakai ID-nya)
+ENTITY_COLUMNS = ["Prospek", "Penggali", "Pemilik Lahan"]
+CACHE_MAX = 64
+
+# Kamus per daftar kategori (CategoricalDtype) -> (kamus, ID per kode kategori). Kolom entitas dari
+# compact_frame membawa kamusnya lewat dtype, jadi semua stage memakai ID yang sama tanpa normalisasi ulang.
+_by_dtype = {}
+
+
+def normalize_name(value):
+    return str(value).strip().casefold()
+
+
+class EntityDictionary:
+    # Nama -> ID integer kecil. Kunci = nama di-trim + casefold, jadi "Budi " dan "budi" entitas yang sama;
+    # ejaan pertama yang ditemui (tanpa spasi tepi) menjadi nama tampilan. NaN -> -1.
+    # Normalisasi dilakukan per nilai unik (factorize), bukan per baris.
+    def __init__(self):
+        self.ids = {}
+        self.keys = []
+        self.names = []
+        self._ranks = None
+
+    @classmethod
+    def _from_names(cls, names):
+        entities = cls()
+        entities.ids = {normalize_name(name): i for i, name in enumerate(names)}
+        entities.keys = list(entities.ids)
+        entities.names = list(names)
+        return entities
+
+    def _encode(self, values, add):
+        series = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+        codes, uniques = pd.factorize(series)
+        mapped = np.full(len(uniques) + 1, -1, dtype=np.int32)  # posisi -1 = nilai kosong
+        for i, value in enumerate(uniques):
+            key = normalize_name(value)
+            entity = self.ids.get(key)
+            if entity is None and add:
+                entity = self.ids[key] = len(self.keys)
+                self.keys.append(key)
+                self.names.append(value.strip() if isinstance(value, str) else value)
+                self._ranks = None
+            if entity is not None:
+                mapped[i] = entity
+        return mapped[codes]
+
+    def intern(self, values):
+        # ID per baris; nama baru ditambahkan ke kamus
+        return self._encode(values, add=True)
+
+    def lookup(self, values):
+        # ID per baris tanpa menambah nama baru; nama yang tidak dikenal -> -1
+        return self._encode(values, add=False)
+
+    def canonical(self, values):
+        # Kolom kategori berisi nama tampilan (ejaan lain dari entitas yang sama ikut disatukan).
+        # Kategori diurutkan seperti astype("category"), jadi sort/groupby pada kolom tetap sama.
+        # Kamus untuk dtype hasilnya langsung didaftarkan (ID = kode kategori), lihat entity_ids.
+        ids = self.intern(values)
+        series = values if isinstance(values, pd.Series) else pd.Series(values)
+        names = pd.Index(self.names, dtype=object)
+        categories = pd.Categorical.from_codes(ids, categories=names).reorder_categories(names.sort_values())
+        _remember(categories.dtype, EntityDictionary._from_names(list(categories.categories)),
+                  np.arange(len(names), dtype=np.int32))
+        return pd.Series(categories, index=series.index, name=series.name)
+
+    def sort_ranks(self):
+        # Peringkat tiap ID menurut kunci ternormalisasi (untuk sort nama tanpa lower() per baris);
+        # posisi terakhir = -1 supaya ranks[ids] juga berlaku untuk NaN (ID -1, paling depan)
+        if self._ranks is None:
+            ranks = np.full(len(self.keys) + 1, -1, dtype=np.int64)
+            ranks[sorted(range(len(self.keys)), key=self.keys.__getitem__)] = np.arange(len(self.keys))
+            self._ranks = ranks
+        return self._ranks
+
+
+def _remember(dtype, entities, remap):
+    if len(_by_dtype) >= CACHE_MAX:
+        _by_dtype.clear()
+    _by_dtype[dtype] = (entities, remap)
+
+
+def entity_ids(column):
+    # -> (kamus, ID per baris). Kolom kategori: ID dari kode kategori lewat kamus milik dtype-nya (dibangun
+    # sekali per daftar kategori, dipakai ulang oleh semua stage); kolom lain di-intern ke kamus baru.
+    # Kamus yang dikembalikan hanya untuk lookup, jangan di-intern.
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        cached = _by_dtype.get(column.dtype)
+        if cached is None:
+            entities = EntityDictionary()
+            cached = (entities, entities.intern(pd.Series(column.cat.categories, dtype=object)))
+            _remember(column.dtype, *cached)
+        entities, remap = cached
+        codes = column.cat.codes.to_numpy()
+        return entities, np.where(codes >= 0, remap[codes], -1).astype(np.int32)
+    entities = EntityDictionary()
+    return entities, entities.intern(column)
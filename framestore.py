@@ -0,0 +1,269 @@
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections.abc import MutableMapping
+
+import numpy as np
+import pandas as pd
+
+from cache import fingerprint_frame
+
+logger = logging.getLogger(__name__)
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def frame_fingerprint(df):
+    # fingerprint_frame + index: frame bersama harus identik termasuk index-nya
+    index = pd.util.hash_pandas_object(df.index, index=False).to_numpy().tobytes()
+    return fingerprint_frame(df, list(df.index.names), hashlib.sha256(index).hexdigest())
+
+
+def _column_buffer(series):
+    # Array data kolom (kode untuk kategori), untuk mengenali kolom salinan dangkal
+    values = series.array
+    return values.codes if isinstance(values, pd.Categorical) else series.to_numpy(copy=False)
+
+
+def _value_bytes(value, held=()):
+    # Objek non-DataFrame (mis. PaymentCount) dihitung dari DataFrame yang dipegangnya, tanpa kolom yang
+    # berbagi memori dengan frame sesi di store (PaymentCount.df adalah salinan dangkal input stage-nya)
+    df = getattr(value, "df", None)
+    if not isinstance(df, pd.DataFrame):
+        return 0
+    usage = df.memory_usage(deep=True, index=True)
+    nbytes = int(usage["Index"])
+    for col in df.columns:
+        buffer = _column_buffer(df[col])
+        if not any(col in frame.columns and np.shares_memory(buffer, _column_buffer(frame[col])) for frame in held):
+            nbytes += int(usage[col])
+    return nbytes
+
+
+def _is_frame_tuple(value):
+    return isinstance(value, tuple) and len(value) > 0 and all(isinstance(item, pd.DataFrame) for item in value)
+
+
+class SharedFrameStore:
+    # DataFrame bersama untuk semua sesi Streamlit di satu server. Frame dengan isi sama disimpan sekali
+    # (kunci = sidik jari isi), setiap sesi hanya memegang referensi bernama. Frame di store dianggap
+    # read-only: ubah lewat copy/assign, jangan in place. Jika total melebihi max_bytes, data sesi yang
+    # paling lama tidak aktif dibuang lebih dulu (sesi yang sedang menulis tidak pernah dibuang).
+    def __init__(self, max_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._frames = {}    # sidik jari -> [df, bytes, jumlah referensi]
+        self._by_id = {}     # id(df) -> sidik jari, supaya frame yang sama tidak di-hash ulang
+        self._sessions = {}  # id sesi -> {"frames": {nama: sidik jari}, "objects": {nama: (nilai, bytes)}, ...}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def new_session_id():
+        return uuid.uuid4().hex
+
+    def session(self, session_id):
+        return SessionFrames(self, session_id)
+
+    def _session(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = {"frames": {}, "objects": {}, "last_seen": time.time()}
+        session["last_seen"] = time.time()
+        return session
+
+    def _release(self, session, name):
+        session["objects"].pop(name, None)
+        fingerprint = session["frames"].pop(name, None)
+        if fingerprint is None:
+            return
+        entry = self._frames[fingerprint]
+        entry[2] -= 1
+        if entry[2] == 0:
+            del self._frames[fingerprint]
+            del self._by_id[id(entry[0])]
+
+    def put(self, session_id, name, value, fingerprint=None):
+        # Kembalikan frame bersama (bisa objek lain dengan isi identik dari sesi lain)
+        if not isinstance(value, pd.DataFrame):
+            with self._lock:
+                session = self._session(session_id)
+                self._release(session, name)
+                nbytes = _value_bytes(value, [self._frames[fp][0] for fp in session["frames"].values()])
+                session["objects"][name] = (value, nbytes)
+                self.evict(keep=session_id)
+            return value
+
+        with self._lock:
+            fingerprint = fingerprint or self._by_id.get(id(value))
+        if fingerprint is None:
+            fingerprint = frame_fingerprint(value)
+
+        with self._lock:
+            session = self._session(session_id)
+            entry = self._frames.get(fingerprint)
+            if entry is None:
+                entry = self._frames[fingerprint] = [value, frame_bytes(value), 0]
+                self._by_id[id(value)] = fingerprint
+            if session["frames"].get(name) != fingerprint:
+                # Tambah referensi dulu, baru lepas yang lama (entry yang sama tidak sempat terhapus)
+                entry[2] += 1
+                self._release(session, name)
+                session["frames"][name] = fingerprint
+            self.evict(keep=session_id)
+            return entry[0]
+
+    def get(self, session_id, name, default=None):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return default
+            session["last_seen"] = time.time()
+            if name in session["frames"]:
+                return self._frames[session["frames"][name]][0]
+            if name in session["objects"]:
+                return session["objects"][name][0]
+            return default
+
+    def has(self, session_id, name):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session is not None and (name in session["frames"] or name in session["objects"])
+
+    def names(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return []
+            return list(session["frames"]) + list(session["objects"])
+
+    def fingerprint(self, session_id, name):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session["frames"].get(name) if session is not None else None
+
+    def delete(self, session_id, name):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._release(session, name)
+
+    def drop_session(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return
+            for name in list(session["frames"]) + list(session["objects"]):
+                self._release(session, name)
+
+    def session_bytes(self, session_id):
+        # Frame yang dipakai bersama dibagi rata ke semua referensinya, jadi jumlah semua sesi = total_bytes
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return 0
+            shared = sum(self._frames[fp][1] / self._frames[fp][2] for fp in session["frames"].values())
+            return int(shared + sum(nbytes for _, nbytes in session["objects"].values()))
+
+    def total_bytes(self):
+        with self._lock:
+            frames = sum(entry[1] for entry in self._frames.values())
+            objects = sum(nbytes for session in self._sessions.values() for _, nbytes in session["objects"].values())
+            return frames + objects
+
+    def evict(self, keep=None):
+        with self._lock:
+            while self.total_bytes() > self.max_bytes:
+                idle = [sid for sid in self._sessions if sid != keep]
+                if not idle:
+                    break
+                victim = min(idle, key=lambda sid: self._sessions[sid]["last_seen"])
+                freed = self.session_bytes(victim)
+                self.drop_session(victim)
+                logger.info("frame store: evicted idle session %s (%.1f MB)", victim[:8], freed / 2**20)
+
+    def report(self):
+        now = time.time()
+        with self._lock:
+            rows = [
+                {
+                    "session": sid[:8],
+                    "frames": len(session["frames"]) + len(session["objects"]),
+                    "memory_mb": self.session_bytes(sid) / 2**20,
+                    "idle_seconds": now - session["last_seen"],
+                }
+                for sid, session in self._sessions.items()
+            ]
+        return pd.DataFrame(rows, columns=["session", "frames", "memory_mb", "idle_seconds"])
+
+
+class SessionFrames(MutableMapping):
+    # Tampilan dict untuk satu sesi (dipakai sebagai store StagePipeline). Tuple berisi DataFrame
+    # (mis. stage "configured") disimpan per elemen supaya elemennya ikut dibagi dan dihitung sekali.
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+
+    def __getitem__(self, name):
+        if self.store.has(self.session_id, name):
+            return self.store.get(self.session_id, name)
+        size = self.store.get(self.session_id, f"{name}#tuple")
+        if size is None:
+            raise KeyError(name)
+        items = [self.store.get(self.session_id, f"{name}#{i}") for i in range(size)]
+        if any(item is None for item in items):
+            raise KeyError(name)
+        return tuple(items)
+
+    def __setitem__(self, name, value):
+        self._delete_tuple(name)
+        if _is_frame_tuple(value):
+            self.store.delete(self.session_id, name)
+            for i, item in enumerate(value):
+                self.store.put(self.session_id, f"{name}#{i}", item)
+            self.store.put(self.session_id, f"{name}#tuple", len(value))
+        else:
+            self.store.put(self.session_id, name, value)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self.store.delete(self.session_id, name)
+        self._delete_tuple(name)
+
+    def _delete_tuple(self, name):
+        size = self.store.get(self.session_id, f"{name}#tuple")
+        if size is None:
+            return
+        for i in range(size):
+            self.store.delete(self.session_id, f"{name}#{i}")
+        self.store.delete(self.session_id, f"{name}#tuple")
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        names = self.store.names(self.session_id)
+        for name in names:
+            if name.endswith("#tuple"):
+                yield name[:-len("#tuple")]
+            elif "#" not in name:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def nbytes(self):
+        return self.store.session_bytes(self.session_id)
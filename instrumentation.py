@@ -0,0 +1,117 @@
+import functools
+import json
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def current_memory():
+    # Memori proses saat ini dalam byte: tracemalloc jika aktif, RSS dari /proc (Linux), selain itu None
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError, IndexError):
+        return None
+
+
+def count_rows(value):
+    if isinstance(value, pd.DataFrame):
+        return len(value)
+    df = getattr(value, "df", None)
+    if isinstance(df, pd.DataFrame):
+        return len(df)
+    return None
+
+
+class Interrupted(Exception):
+    # Dilempar hook untuk menghentikan pekerjaan di batas stage (mis. job dibatalkan); tidak ditelan
+    # seperti error hook lainnya
+    pass
+
+
+class Instrumentation:
+    # Catat durasi, baris masuk/keluar dan selisih memori per stage. Hook dipanggil dengan setiap record.
+    def __init__(self, max_records=1000):
+        self.records = []
+        self.hooks = []
+        self.max_records = max_records
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    def remove_hook(self, hook):
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+
+    def clear(self):
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        record = {"stage": name, "started_at": time.time(), "rows_in": rows_in, "rows_out": None}
+        memory_before = current_memory()
+        started = time.perf_counter()
+        try:
+            yield record
+            record["status"] = "ok"
+        except Exception as e:
+            record["status"] = "error"
+            record["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - started
+            memory_after = current_memory()
+            record["memory_delta_bytes"] = (
+                memory_after - memory_before if memory_before is not None and memory_after is not None else None
+            )
+            self._emit(record)
+
+    def _emit(self, record):
+        self.records.append(record)
+        if len(self.records) > self.max_records:
+            del self.records[:len(self.records) - self.max_records]
+
+        logger.info(
+            "%s: %.3f s, rows %s -> %s, memory %+.1f MB",
+            record["stage"], record["seconds"], record["rows_in"], record["rows_out"],
+            (record["memory_delta_bytes"] or 0) / 2**20,
+        )
+        for hook in list(self.hooks):
+            try:
+                hook(record)
+            except Interrupted:
+                raise
+            except Exception:
+                logger.exception("Instrumentation hook failed for stage %s", record["stage"])
+
+    def to_frame(self):
+        columns = ["stage", "status", "seconds", "rows_in", "rows_out", "memory_delta_bytes", "started_at"]
+        return pd.DataFrame(self.records).reindex(columns=columns)
+
+    def to_json(self):
+        return json.dumps(self.records, default=str, indent=2)
+
+
+def instrumented(name):
+    # Dekorator method: baris masuk = DataFrame argumen pertama (atau self.df), baris keluar = hasil
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            rows_in = next((len(arg) for arg in args if isinstance(arg, pd.DataFrame)), None)
+            if rows_in is None:
+                rows_in = count_rows(self)
+            with self.instrumentation.stage(name, rows_in=rows_in) as record:
+                result = method(self, *args, **kwargs)
+                record["rows_out"] = count_rows(result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import Interrupted
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, ERROR, CANCELLED = "queued", "running", "done", "error", "cancelled"
+
+
+class JobCancelled(Interrupted):
+    pass
+
+
+class Job:
+    # Satu pekerjaan latar belakang. Progres = stage instrumentasi yang selesai / jumlah stage yang
+    # diharapkan; pembatalan dicek di setiap batas stage (kooperatif).
+    def __init__(self, name, key=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.key = key
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.expected = None
+        self.steps = 0
+        self.thread_id = None
+        self.future = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, ERROR, CANCELLED)
+
+    def cancel(self):
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            self.status = CANCELLED
+            self.finished_at = time.time()
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    def expect(self, steps):
+        self.expected = steps
+
+    def step(self, message):
+        self.steps += 1
+        self.message = message
+        if self.expected:
+            self.progress = min(self.steps / self.expected, 0.99)
+        self.check()
+
+    def hook(self, record):
+        # Hook Instrumentation: hanya stage dari thread job ini yang dihitung
+        if threading.get_ident() == self.thread_id:
+            self.step(record["stage"])
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+            "seconds": (self.finished_at or time.time()) - self.started_at if self.started_at else None,
+        }
+
+
+class JobRunner:
+    # Pool thread lokal untuk langkah berat aplikasi. Thread (bukan proses) karena job memakai frame dan
+    # closure pipeline sesi tanpa perlu di-pickle; render Excel paralel tetap memakai pool prosesnya sendiri.
+    def __init__(self, max_workers=2, max_jobs=64):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gajian-job")
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, name, func, *args, key=None, instrumentation=None, **kwargs):
+        # func(job, *args, **kwargs). Job dengan key sama yang masih antre/berjalan/sukses dipakai ulang.
+        with self._lock:
+            if key is not None:
+                for job in reversed(self.jobs.values()):
+                    if job.key == key and job.status in (QUEUED, RUNNING, DONE):
+                        return job
+            job = Job(name, key)
+            self.jobs[job.id] = job
+            self._trim()
+            job.future = self.executor.submit(self._run, job, func, args, kwargs, instrumentation)
+        return job
+
+    def _run(self, job, func, args, kwargs, instrumentation):
+        if job.cancelled:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            return
+        job.thread_id = threading.get_ident()
+        job.started_at = time.time()
+        job.status = RUNNING
+        if instrumentation is not None:
+            instrumentation.add_hook(job.hook)
+        try:
+            job.result = func(job, *args, **kwargs)
+            job.progress = 1.0
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+            logger.info("job %s (%s) cancelled", job.id, job.name)
+        except Exception as e:
+            job.status = ERROR
+            job.error = f"{type(e).__name__}: {e}"
+            logger.exception("job %s (%s) failed", job.id, job.name)
+        finally:
+            if instrumentation is not None:
+                instrumentation.remove_hook(job.hook)
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _trim(self):
+        # Job selesai yang paling lama dibuang lebih dulu (beserta hasilnya)
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        while len(self.jobs) > self.max_jobs and finished:
+            del self.jobs[finished.pop(0)]
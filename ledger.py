@@ -0,0 +1,155 @@
+import logging
+import sqlite3
+import time
+from contextlib import closing
+
+import pandas as pd
+
+from modul import PaymentCount
+
+logger = logging.getLogger(__name__)
+
+# Kolom hasil get_result -> kolom tabel payments
+LEDGER_COLUMNS = {
+    "Kode Testpit": "kode_testpit",
+    "Tanggal Sampling": "tanggal_sampling",
+    "Grid": "grid",
+    "Prospek": "prospek",
+    "Penggali": "penggali",
+    "Kelompok Penggali": "kelompok_penggali",
+    "Pemilik Lahan": "pemilik_lahan",
+    "Tarif Galian": "tarif_galian",
+    "Tarif Samplingan": "tarif_samplingan",
+    "Tarif Timbunan": "tarif_timbunan",
+    "Tarif Kompensasi": "tarif_kompensasi",
+    "Tarif Langsiran": "tarif_langsiran",
+    "Tarif Angkutan": "tarif_angkutan",
+}
+TEXT_COLUMNS = ["kode_testpit", "tanggal_sampling", "grid", "prospek", "penggali", "kelompok_penggali", "pemilik_lahan"]
+TARIF_COLUMNS = [LEDGER_COLUMNS[col] for col in PaymentCount.TARIF_COLUMNS]
+# Kolom tanda dari flag_paid (bukan input tarif)
+PAID_COLUMN = "Sudah Dibayar"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS payments (
+    period TEXT NOT NULL,
+    iup TEXT NOT NULL,
+    {", ".join(f"{col} TEXT" for col in TEXT_COLUMNS)},
+    {", ".join(f"{col} REAL" for col in TARIF_COLUMNS)},
+    total REAL,
+    recorded_at TEXT NOT NULL,
+    PRIMARY KEY (kode_testpit, period, iup)
+);
+CREATE INDEX IF NOT EXISTS idx_payments_testpit ON payments (kode_testpit);
+CREATE INDEX IF NOT EXISTS idx_payments_penggali ON payments (penggali, period);
+CREATE INDEX IF NOT EXISTS idx_payments_pemilik ON payments (pemilik_lahan, period);
+CREATE INDEX IF NOT EXISTS idx_payments_prospek ON payments (prospek, period);
+CREATE INDEX IF NOT EXISTS idx_payments_period ON payments (period, iup);
+"""
+
+
+def _as_text(values):
+    # Teks untuk SQLite; nilai kosong menjadi NULL
+    values = pd.Series(values).astype(object)
+    return values.astype(str).where(values.notna(), None)
+
+
+class PaymentLedger:
+    # Buku besar pembayaran (SQLite): setiap baris get_result dicatat dengan periode gaji dan IUP.
+    # Koneksi dibuka per operasi supaya aman dipakai dari thread Streamlit mana pun.
+    def __init__(self, path):
+        self.path = str(path)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def record(self, result_df, period, iup):
+        # Periode + IUP yang sama dicatat ulang menggantikan baris lama (idempoten)
+        rows = pd.DataFrame(index=result_df.index)
+        for source, target in LEDGER_COLUMNS.items():
+            rows[target] = result_df[source] if source in result_df.columns else None
+        for col in TEXT_COLUMNS:
+            values = rows[col].astype(object)
+            if col == "tanggal_sampling":
+                values = pd.to_datetime(values, errors="coerce").dt.strftime("%Y-%m-%d")
+            rows[col] = _as_text(values)
+        tarif = rows[TARIF_COLUMNS].apply(pd.to_numeric, errors="coerce")
+        rows[TARIF_COLUMNS] = tarif.astype(object).where(tarif.notna(), None)
+        rows["total"] = tarif.fillna(0).sum(axis=1)
+        rows = rows[rows["kode_testpit"].notna()]
+
+        columns = ["period", "iup", *TEXT_COLUMNS, *TARIF_COLUMNS, "total", "recorded_at"]
+        recorded_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        records = [
+            (str(period), str(iup), *values, recorded_at)
+            for values in rows[[*TEXT_COLUMNS, *TARIF_COLUMNS, "total"]].itertuples(index=False, name=None)
+        ]
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO payments ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                records,
+            )
+        logger.info("ledger: %d testpit recorded for %s / %s", len(records), iup, period)
+        return len(records)
+
+    def paid_periods(self, kode_testpit, exclude_period=None, exclude_iup=None):
+        # Periode pembayaran sebelumnya untuk banyak testpit sekaligus (join dengan tabel sementara)
+        codes = pd.Series(kode_testpit).dropna().astype(str).unique()
+        with closing(self._connect()) as conn:
+            conn.execute("CREATE TEMP TABLE lookup (kode_testpit TEXT PRIMARY KEY)")
+            conn.executemany("INSERT INTO lookup VALUES (?)", ((code,) for code in codes))
+            query = """
+                SELECT p.kode_testpit, group_concat(p.iup || ' ' || p.period, ', ') AS dibayar
+                FROM lookup l JOIN payments p ON p.kode_testpit = l.kode_testpit
+                WHERE NOT (p.period IS ? AND p.iup IS ?)
+                GROUP BY p.kode_testpit
+            """
+            paid = pd.read_sql_query(query, conn, params=(exclude_period, exclude_iup))
+        return paid.set_index("kode_testpit")["dibayar"]
+
+    def flag_paid(self, df, exclude_period=None, exclude_iup=None):
+        # Tandai testpit yang sudah pernah dibayar di periode/IUP lain, sebelum perhitungan tarif
+        flagged = df.copy(deep=False)
+        if "Kode Testpit" not in df.columns:
+            return flagged
+        paid = self.paid_periods(df["Kode Testpit"], exclude_period, exclude_iup)
+        flagged[PAID_COLUMN] = _as_text(df["Kode Testpit"]).map(paid)
+        count = int(flagged[PAID_COLUMN].notna().sum())
+        if count:
+            logger.warning("ledger: %d testpit already paid in an earlier period", count)
+        return flagged
+
+    def testpit_history(self, kode_testpit):
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query(
+                "SELECT * FROM payments WHERE kode_testpit = ? ORDER BY period", conn, params=(str(kode_testpit),)
+            )
+
+    def earnings(self, by="penggali", start_period=None, end_period=None, name=None):
+        # Total pembayaran per penggali/pemilik_lahan/prospek dalam rentang periode (inklusif)
+        if by not in ("penggali", "pemilik_lahan", "prospek"):
+            raise ValueError(f"Unsupported ledger grouping: {by}")
+        conditions, params = [], []
+        if name is not None:
+            conditions.append(f"{by} = ?")
+            params.append(str(name))
+        if start_period is not None:
+            conditions.append("period >= ?")
+            params.append(str(start_period))
+        if end_period is not None:
+            conditions.append("period <= ?")
+            params.append(str(end_period))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"""
+            SELECT {by}, COUNT(*) AS testpit, {", ".join(f"SUM({col}) AS {col}" for col in TARIF_COLUMNS)},
+                   SUM(total) AS total
+            FROM payments {where}
+            GROUP BY {by}
+            ORDER BY {by}
+        """
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query(query, conn, params=params)
@@ -1,18 +1,77 @@
+import io
+import logging
+import zipfile
 import pandas as pd
 import numpy as np
 import math
+from datetime import datetime
 import bisect
+from concurrent.futures import ProcessPoolExecutor
 from openpyxl import Workbook
+from openpyxl.cell import Cell, WriteOnlyCell
 from openpyxl.styles import Font, Alignment, Border, Side, NamedStyle, PatternFill
+from openpyxl.styles.cell_style import StyleArray
 from openpyxl.utils import get_column_letter
-from typing import List, Union
-from collections import defaultdict
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+from typing import List
+from cache import fingerprint_frame
+from dates import parse_dates
+from entities import ENTITY_COLUMNS, EntityDictionary, entity_ids
+from instrumentation import Instrumentation, instrumented
+from tarif import CATEGORIES, PriceIndex, TariffSet, default_rules, tariff_column
+
+logger = logging.getLogger(__name__)
+
+# Kolom teks yang nilainya banyak berulang disimpan sebagai kategori
+CATEGORY_COLUMNS = ["Grid", "Prospek", "Penggali", "Pemilik Lahan"]
+# Kolom jumlah (koli/orang) cukup float32: bilangan bulat tetap eksak dan NaN tetap bisa.
+# Total Kedalaman tetap float64 karena dicocokkan persis dengan kunci tabel harga galian.
+COUNT_COLUMNS = ["Total Koli", "Pengangkut", "Penimbun"]
+
+
+def compact_frame(df, category_columns=CATEGORY_COLUMNS, count_columns=COUNT_COLUMNS):
+    compact = df.copy(deep=False)
+    for col in category_columns:
+        if col in compact.columns and compact[col].dtype == object:
+            if col in ENTITY_COLUMNS:
+                # Nama entitas disatukan per kunci trim + casefold ("Budi " = "budi"); kamusnya dibangun
+                # sekali di sini dan ikut dtype kolom (ID = kode kategori) untuk stage berikutnya
+                compact[col] = EntityDictionary().canonical(compact[col])
+            else:
+                compact[col] = compact[col].astype("category")
+    for col in count_columns:
+        if col in compact.columns and pd.api.types.is_float_dtype(compact[col]):
+            compact[col] = compact[col].astype("float32")
+    return compact
+
+
+def memory_report(before, after):
+    # Pemakaian memori per kolom (byte, termasuk isi string) sebelum dan sesudah compact_frame
+    report = pd.DataFrame({
+        "dtype_before": before.dtypes.astype(str),
+        "bytes_before": before.memory_usage(index=False, deep=True),
+        "dtype_after": after.dtypes.astype(str),
+        "bytes_after": after.memory_usage(index=False, deep=True),
+    }).rename_axis("column").reset_index()
+    total = {"column": "Total", "dtype_before": "", "dtype_after": "",
+             "bytes_before": report["bytes_before"].sum(), "bytes_after": report["bytes_after"].sum()}
+    return pd.concat([report, pd.DataFrame([total])], ignore_index=True)
+
 
 class DataFilterAndSelect:
     COLUMNS = ["Kode Testpit", "Grid", "Prospek", "Tanggal Sampling", "Total Kedalaman",
                "Total Koli", "Pemilik Lahan", "Penggali", "Pengangkut", "Penimbun"]
-           
-    def __init__(self, source):
+    # Tipe kolom dipatok saat membaca CSV; tanggal dibaca sebagai teks lalu dikonversi di __init__
+    DTYPES = {
+        "Kode Testpit": "object", "Grid": "object", "Prospek": "object", "Tanggal Sampling": "object",
+        "Total Kedalaman": "float64", "Total Koli": "float64", "Pemilik Lahan": "object",
+        "Penggali": "object", "Pengangkut": "float64", "Penimbun": "float64",
+    }
+    CHUNKSIZE = 100_000
+
+    def __init__(self, source, instrumentation=None):
+        self.instrumentation = instrumentation or Instrumentation()
         if isinstance(source, pd.DataFrame):
             self.df = source
         elif isinstance(source, str):  # assume filename
@@ -23,28 +82,82 @@ class DataFilterAndSelect:
         else:
             raise ValueError("Unsupported input type for DataFilterAndSelect")
 
-        # Konversi kolom tanggal jika ada
+        # Konversi kolom tanggal jika ada (format dideteksi sekali, hanya nilai unik yang diparse)
         if "Tanggal Sampling" in self.df.columns:
-            self.df["Tanggal Sampling"] = pd.to_datetime(
-                self.df["Tanggal Sampling"], errors='coerce', dayfirst=True
-            )
+            self.df["Tanggal Sampling"] = parse_dates(self.df["Tanggal Sampling"])
 
         self.cleanData = None
-        
+        self.memory_report = None
+
+    @classmethod
+    def from_csv(cls, source, engine="c", chunksize=None, instrumentation=None):
+        # Baca hanya kolom COLUMNS dengan tipe tetap, buang baris tanpa Total Kedalaman per chunk
+        chunksize = chunksize or cls.CHUNKSIZE
+        instrumentation = instrumentation or Instrumentation()
+        with instrumentation.stage(f"DataFilterAndSelect.from_csv[{engine}]") as record:
+            df = cls._read_csv(source, engine, chunksize)
+            record["rows_out"] = len(df)
+        return cls(df[cls.COLUMNS], instrumentation)
+
+    @classmethod
+    def _read_csv(cls, source, engine, chunksize):
+        try:
+            if engine == "pyarrow":
+                df = cls._read_csv_pyarrow(source, chunksize)
+            else:
+                chunks = pd.read_csv(
+                    source, encoding="utf-8", usecols=cls.COLUMNS, dtype=cls.DTYPES, chunksize=chunksize
+                )
+                kept = [chunk[chunk["Total Kedalaman"].notna()] for chunk in chunks]
+                df = pd.concat(kept, ignore_index=True) if kept else pd.DataFrame(columns=cls.COLUMNS)
+        except Exception as e:
+            raise ValueError(f"Failed to load CSV file '{getattr(source, 'name', source)}': {e}")
+        return df
+
+    @classmethod
+    def _read_csv_pyarrow(cls, source, block_size):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.csv as pa_csv
+
+        types = {col: (pa.float64() if dtype == "float64" else pa.string()) for col, dtype in cls.DTYPES.items()}
+        reader = pa_csv.open_csv(
+            source,
+            # block_size dalam byte; kira-kira 256 byte per baris export
+            read_options=pa_csv.ReadOptions(block_size=block_size * 256),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=cls.COLUMNS, column_types=types, strings_can_be_null=True
+            ),
+        )
+        batches = []
+        for batch in reader:
+            kedalaman = batch.column("Total Kedalaman")
+            keep = pc.and_(pc.is_valid(kedalaman), pc.invert(pc.is_nan(kedalaman)))
+            batches.append(batch.filter(pc.fill_null(keep, False)))
+        return pa.Table.from_batches(batches, schema=reader.schema).to_pandas()
+
+    @instrumented("DataFilterAndSelect.filter_and_select")
     def filter_and_select(self):
         filtered_df = self.df.loc[self.df["Total Kedalaman"].notna(), self.COLUMNS].copy()
         if filtered_df.empty:
             raise ValueError("Kolom Contoh Error")
-        
-        self.cleanData = filtered_df
+
+        self.cleanData = compact_frame(filtered_df)
+        self.memory_report = memory_report(filtered_df, self.cleanData)
+        logger.info(
+            "cleanData memory: %.1f MB -> %.1f MB",
+            self.memory_report["bytes_before"].iloc[-1] / 2**20, self.memory_report["bytes_after"].iloc[-1] / 2**20,
+        )
         return self.cleanData
 
 
 class ConfigurationInput:
-    def __init__(self):
+    def __init__(self, instrumentation=None):
+        self.instrumentation = instrumentation or Instrumentation()
         self.stage1 = None
         self.stage2 = None
         self.stage3 = None
+        self._filtered = None
 
     @staticmethod
     def _merge_stage_data(existing_df, new_df, subset):
@@ -52,8 +165,9 @@ class ConfigurationInput:
             return new_df
         return pd.concat([existing_df, new_df], ignore_index=True).drop_duplicates(subset=subset)
 
+    @instrumented("ConfigurationInput.process_stage1")
     def process_stage1(self, cleanData):
-        unique_locations = cleanData["Prospek"].unique()
+        unique_locations = np.asarray(cleanData["Prospek"].unique(), dtype=object)
         new_data = pd.DataFrame({
             "Lokasi": unique_locations,
             "Tanggal Mulai (2025-05-23)": pd.NaT,
@@ -72,45 +186,76 @@ class ConfigurationInput:
         self.stage1 = self._merge_stage_data(self.stage1, new_data, subset=["Lokasi"])
         return self.stage1
 
+    @staticmethod
+    def _build_location_index(cleanData):
+        # Urutkan sekali per (ID Prospek, Tanggal Sampling); baris tanpa tanggal tidak pernah lolos filter
+        entities, codes = entity_ids(cleanData["Prospek"])
+        dates = pd.to_datetime(cleanData["Tanggal Sampling"], errors="coerce").to_numpy(dtype="datetime64[ns]")
+        valid = (codes >= 0) & ~np.isnat(dates)
+        if (~valid).any():
+            logger.warning("%d rows without Prospek or a valid Tanggal Sampling are excluded from every location filter",
+                           int((~valid).sum()))
+
+        positions = np.flatnonzero(valid)
+        order = np.lexsort((dates[positions], codes[positions]))
+        positions = positions[order]
+        sorted_codes = codes[positions]
+        sorted_dates = dates[positions]
+        return entities, positions, sorted_codes, sorted_dates
+
+    @instrumented("ConfigurationInput.filter_by_location_and_date")
     def _filter_by_location_and_date(self, cleanData, stage1_data):
-        filtered_chunks = []
-
-        for _, row in stage1_data.iterrows():
-            lokasi = row["Lokasi"]
-            tgl_mulai = row["Tanggal Mulai (2025-05-23)"]
-            tgl_selesai = row["Tanggal Selesai (2025-05-23)"]
-
-            print(f"🔍 Filtering for Lokasi: {lokasi} | Start: {tgl_mulai} | End: {tgl_selesai}")
-
+        # Hasil dipakai bersama oleh stage 2 dan stage 3 selama isi inputnya sama (bukan objek yang sama,
+        # supaya frame yang diubah di tempat atau dibaca ulang tidak memakai hasil lama)
+        key = (fingerprint_frame(cleanData), fingerprint_frame(stage1_data))
+        cached = self._filtered
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        entities, positions, sorted_codes, sorted_dates = self._build_location_index(cleanData)
+        # Lokasi template dicocokkan lewat kunci ternormalisasi, bukan teks persis
+        lokasi_codes = entities.lookup(stage1_data["Lokasi"])
+        selected = []
+
+        for lokasi, code, tgl_mulai, tgl_selesai in zip(
+            stage1_data["Lokasi"],
+            lokasi_codes,
+            stage1_data["Tanggal Mulai (2025-05-23)"],
+            stage1_data["Tanggal Selesai (2025-05-23)"],
+        ):
             if pd.isna(tgl_mulai) and pd.isna(tgl_selesai):
                 continue  # skip rows without a date filter
 
-            filtered = cleanData[cleanData["Prospek"] == lokasi]
-
-            if pd.notna(tgl_mulai) and pd.notna(tgl_selesai):
-                filtered = filtered[(filtered["Tanggal Sampling"] >= tgl_mulai) & (filtered["Tanggal Sampling"] <= tgl_selesai)]
-            elif pd.notna(tgl_mulai):
-                filtered = filtered[filtered["Tanggal Sampling"] >= tgl_mulai]
-            elif pd.notna(tgl_selesai):
-                filtered = filtered[filtered["Tanggal Sampling"] <= tgl_selesai]
+            matched = np.empty(0, dtype=positions.dtype)
+            if code >= 0:
+                # Blok lokasi lalu jendela tanggal, keduanya lewat binary search
+                lo = np.searchsorted(sorted_codes, code, side="left")
+                hi = np.searchsorted(sorted_codes, code, side="right")
+                block = sorted_dates[lo:hi]
+                start = 0 if pd.isna(tgl_mulai) else np.searchsorted(block, np.datetime64(pd.Timestamp(tgl_mulai), "ns"), side="left")
+                stop = len(block) if pd.isna(tgl_selesai) else np.searchsorted(block, np.datetime64(pd.Timestamp(tgl_selesai), "ns"), side="right")
+                # Urutan baris asli dipertahankan di dalam setiap lokasi
+                matched = np.sort(positions[lo + start:lo + max(start, stop)])
 
-            print(f"✅ Matched rows for '{lokasi}': {len(filtered)}")
+            logger.debug("Lokasi %s (%s - %s): %d rows matched", lokasi, tgl_mulai, tgl_selesai, len(matched))
 
-            if not filtered.empty:
-                filtered_chunks.append(filtered)
+            if len(matched):
+                selected.append(matched)
 
-        if filtered_chunks:
-            result = pd.concat(filtered_chunks, ignore_index=True)
-            print(f"🔍 Filtered cleanData rows: {len(result)}")
-            return result
+        if selected:
+            result = cleanData.iloc[np.concatenate(selected)].reset_index(drop=True)
         else:
-            print("⚠️ No data matched any filters.")
-            return pd.DataFrame(columns=cleanData.columns)
+            logger.warning("No data matched any location/date filter")
+            result = pd.DataFrame(columns=cleanData.columns)
+
+        self._filtered = (key, result)
+        return result
 
+    @instrumented("ConfigurationInput.process_stage2")
     def process_stage2(self, cleanData, stage1_data):
         filtered_data = self._filter_by_location_and_date(cleanData, stage1_data)
         if filtered_data.empty:
-            print("⚠️ Stage 2: No matching rows found after filter.")
+            logger.warning("Stage 2: no matching rows found after filter")
             return pd.DataFrame(columns=["Penggali", "Kelompok Penggali", "Harga Galian (Lokal/Luar)", "Harga Samplingan (Lokal/Luar)"])
 
         penggali_gajian = filtered_data["Penggali"].unique()
@@ -123,140 +268,335 @@ class ConfigurationInput:
         self.stage2 = self._merge_stage_data(self.stage2, new_data, subset=["Penggali"])
         return self.stage2
 
+    @instrumented("ConfigurationInput.process_stage3")
     def process_stage3(self, cleanData, stage1_data):
-        result = self._filter_by_location_and_date(cleanData, stage1_data)
+        filtered_data = self._filter_by_location_and_date(cleanData, stage1_data)
     
-        # Create mapping from Lokasi to Sistem Angkutan
-        mapping = stage1_data.set_index("Lokasi")["Sistem Angkutan (Koli/Kilo)"].to_dict()
+        # Sistem Angkutan per ID Prospek; Lokasi ganda di template -> baris terakhir yang dipakai
+        entities, prospek = entity_ids(filtered_data["Prospek"])
+        lokasi = entities.lookup(stage1_data["Lokasi"])
+        known = lokasi >= 0
+        sistem = np.full(len(entities.keys) + 1, np.nan, dtype=object)  # posisi -1 = tidak ada di template
+        sistem[lokasi[known]] = stage1_data["Sistem Angkutan (Koli/Kilo)"].to_numpy(dtype=object)[known]
     
-        # Map to result DataFrame
-        result["SistemAngkutan"] = result["Prospek"].map(mapping)
+        # Map to result DataFrame (salinan, karena hasil filter dipakai bersama dengan stage 2)
+        result = filtered_data.assign(SistemAngkutan=sistem[prospek])
     
         self.stage3 = result
         return result
 
+# Tarif set milik proses worker perhitungan paralel (dikirim sekali lewat initializer pool)
+_worker_tariffs = None
+
+
+def _init_pricing_worker(tariffs):
+    global _worker_tariffs
+    _worker_tariffs = tariffs
+
+
+def _price_part(df):
+    # Dijalankan di proses worker: rantai harga_* untuk satu potongan baris, hanya kolom tarif yang dikirim balik
+    priced = PaymentCount(tariffs=_worker_tariffs).set_data(df).price().df
+    return priced[[col for col in PaymentCount.TARIF_COLUMNS if col in priced.columns]]
+
+
 class PaymentCount:
-    def __init__(self, harga_galian_lokal, harga_galian_luar,
-                 harga_samplingan_lokal, harga_samplingan_luar):
-        self.harga_galian_lokal = harga_galian_lokal
-        self.harga_galian_luar = harga_galian_luar
-        self.harga_samplingan_lokal = harga_samplingan_lokal
-        self.harga_samplingan_luar = harga_samplingan_luar
+    # Tarif tetap (Rupiah), dipakai jika tidak ada konfigurasi tarif (lihat tarif.json / TariffConfig)
+    TARIF_TIMBUNAN_PER_METER = 12000
+    TARIF_KOMPENSASI = 90000
+    TARIF_LANGSIRAN_PER_KOLI = 1000
+    TARIF_ANGKUTAN_PER_KOLI = 1000
+    TARIF_ANGKUTAN_PER_KILO = 1000
+
+    TARIF_COLUMNS = list(CATEGORIES.values())
+    # Di bawah ini per potongan, ongkos proses worker lebih besar dari perhitungannya
+    PARALLEL_MIN_ROWS = 50_000
+
+    def __init__(self, harga_galian_lokal=None, harga_galian_luar=None,
+                 harga_samplingan_lokal=None, harga_samplingan_luar=None, instrumentation=None,
+                 tariffs: TariffSet = None, workers: int = 1):
+        self.instrumentation = instrumentation or Instrumentation()
+        self.workers = workers
+        if tariffs is None:
+            tariffs = TariffSet(default_rules(
+                harga_galian_lokal, harga_galian_luar, harga_samplingan_lokal, harga_samplingan_luar,
+                timbunan_per_meter=self.TARIF_TIMBUNAN_PER_METER,
+                kompensasi=self.TARIF_KOMPENSASI,
+                langsiran_per_koli=self.TARIF_LANGSIRAN_PER_KOLI,
+                angkutan_per_koli=self.TARIF_ANGKUTAN_PER_KOLI,
+                angkutan_per_kilo=self.TARIF_ANGKUTAN_PER_KILO,
+            ))
+        self.tariffs = tariffs
         self.df = None
+        self._rollup = None
+
+    def tarif_fingerprint(self):
+        # Berubah jika tabel harga atau tarif berubah -> hasil lama tidak boleh dipakai lagi
+        return self.tariffs.fingerprint()
 
+    @instrumented("PaymentCount.set_data")
     def set_data(self, df):
-        self.df = df.copy()
+        # Salinan dangkal (copy-on-write): setiap langkah hanya mengganti kolom utuh,
+        # jadi kolom data sumber dipakai bersama dan tidak pernah ditulis
+        self.df = df.copy(deep=False)
+        self._rollup = None
         return self
 
+    def _apply_tarif(self, category):
+        # Satu kategori dihitung untuk semua baris sekaligus dari aturan tarif yang sudah dikompilasi
+        self._rollup = None
+        column = CATEGORIES[category]
+        values, found, integer = self.tariffs.evaluate(category, self.df)
+        missing = self.tariffs.missing(category)
+        if missing == "keep":
+            # Baris tanpa pilihan atau tanpa harga tidak diubah
+            if not found.any() and column not in self.df.columns:
+                return
+            if column in self.df.columns:
+                values = np.where(found, values, self.df[column].to_numpy(dtype="float64"))
+        elif missing is not None:
+            values = np.where(found, values, missing)
+        self.df[column] = tariff_column(values, integer)
+
+    @instrumented("PaymentCount.harga_galian")
     def harga_galian(self):
-        def merge_row(row):
-            key = "Harga Galian (Lokal/Luar)"
-            if key not in row or pd.isna(row[key]):
-                return row
-
-            if row[key].strip().lower() == "luar":
-                harga_row = self.harga_galian_luar[self.harga_galian_luar["Kedalaman"] == row["Total Kedalaman"]]
-            else:
-                harga_row = self.harga_galian_lokal[self.harga_galian_lokal["Kedalaman"] == row["Total Kedalaman"]]
-
-            if not harga_row.empty:
-                row["Tarif Galian"] = harga_row.iloc[0]["Harga"]
-            return row
-
-        self.df = self.df.apply(merge_row, axis=1)
+        self._apply_tarif("galian")
         return self
 
+    @instrumented("PaymentCount.harga_samplingan")
     def harga_samplingan(self):
-        def merge_row(row):
-            key = "Harga Samplingan (Lokal/Luar)"
-            
-            # NEW: Default to 0 if key is missing or NaN
-            if key not in row or pd.isna(row[key]):
-                row["Tarif Samplingan"] = 0
-                return row
-    
-            if row[key].strip().lower() == "luar":
-                harga_row = self.harga_samplingan_luar[self.harga_samplingan_luar["Total Koli"] == row["Total Koli"]]
-            else:
-                harga_row = self.harga_samplingan_lokal[self.harga_samplingan_lokal["Total Koli"] == row["Total Koli"]]
-    
-            if not harga_row.empty:
-                row["Tarif Samplingan"] = harga_row.iloc[0]["Harga"]
-            else:
-                # NEW: Set to 0 when no match is found
-                row["Tarif Samplingan"] = 0
-    
-            return row
-    
-        self.df = self.df.apply(merge_row, axis=1)
+        # Default 0 jika pilihan kosong atau harga tidak ditemukan
+        self._apply_tarif("samplingan")
         return self
 
+    @instrumented("PaymentCount.harga_timbunan_dan_kompensasi_langsiran")
     def harga_timbunan_dan_kompensasi_langsiran(self):
-        self.df["Tarif Timbunan"] = self.df["Total Kedalaman"] * 12000
-        self.df["Tarif Kompensasi"] = 90000
-        self.df["Tarif Langsiran"] = self.df["Penimbun"] * 1000 * self.df["Total Koli"]
+        for category in ("timbunan", "kompensasi", "langsiran"):
+            self._apply_tarif(category)
         return self
 
+    @instrumented("PaymentCount.harga_angkutan")
     def harga_angkutan(self):
-        def hitung_angkutan(row):
-            sistem = str(row.get("SistemAngkutan", "")).strip().lower()
-            
-            if sistem == "koli":
-                return row.get("Total Koli", 0) * row.get("Pengangkut", 0) * 1000  
-            elif sistem == "kilo":
-                return row.get("Pengangkut", 0) * 1000   
-            else:
-                return 0  
-    
-        self.df["Tarif Angkutan"] = self.df.apply(hitung_angkutan, axis=1)
+        # NaN Pengangkut / Total Koli dihitung 0, bukan ikut menjadi NaN
+        self._apply_tarif("angkutan")
         return self
 
+    @classmethod
+    def partitions(cls, n_rows, workers):
+        # Jumlah potongan untuk price(); 1 = serial (data terlalu kecil atau workers = 1)
+        return max(1, min(workers, n_rows // cls.PARALLEL_MIN_ROWS))
+
+    def price(self):
+        # Semua harga_* sekaligus; dengan workers > 1 dan data cukup besar dihitung paralel
+        partitions = self.partitions(len(self.df), self.workers)
+        if partitions > 1:
+            return self._price_parallel(partitions)
+        return self.harga_galian().harga_samplingan().harga_timbunan_dan_kompensasi_langsiran().harga_angkutan()
+
+    @instrumented("PaymentCount.price_parallel")
+    def _price_parallel(self, partitions):
+        # Tarif dihitung per baris tanpa ketergantungan antar baris (juga antar Prospek), jadi data dibagi
+        # menjadi potongan baris berurutan yang sama besar dan digabung lagi sesuai urutan. Worker hanya
+        # menerima kolom yang dibaca aturan tarif; duplikat Kode Testpit tetap dibuang sesudahnya oleh
+        # get_result, atas hasil gabungan.
+        self._rollup = None
+        needed = set(self.tariffs.columns()) | set(self.TARIF_COLUMNS)
+        inputs = self.df[[col for col in self.df.columns if col in needed]]
+        bounds = np.linspace(0, len(inputs), partitions + 1).astype(int)
+        parts = [inputs.iloc[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+        with ProcessPoolExecutor(max_workers=partitions, initializer=_init_pricing_worker,
+                                 initargs=(self.tariffs,)) as pool:
+            priced = list(pool.map(_price_part, parts))
+
+        # Kolom tarif yang hanya dibuat di sebagian potongan (missing="keep" tanpa harga) menjadi NaN,
+        # sama seperti hasil serial; kolom baru ditambahkan dengan urutan perhitungan serial
+        present = [col for col in self.TARIF_COLUMNS if any(col in part.columns for part in priced)]
+        combined = pd.concat(priced).reindex(columns=present)
+        for col in present:
+            self.df[col] = combined[col].to_numpy()
+        return self
+
+    @instrumented("PaymentCount.get_result")
     def get_result(self):
         if "Kode Testpit" in self.df.columns:
             self.df = self.df.drop_duplicates(subset=["Kode Testpit"])
         return self.df 
     
+    @instrumented("PaymentCount.get_rollup")
+    def get_rollup(self):
+        # Dihitung sekali per hasil pembayaran; dipakai ulang selama self.df tidak berubah
+        cached = self._rollup
+        if cached is not None and cached[0] is self.df:
+            return cached[1]
+        rollup = PaymentRollup(self.df)
+        self._rollup = (self.df, rollup)
+        return rollup
+
+    @instrumented("PaymentCount.get_pivot_summary")
     def get_pivot_summary(self):
-        # Create pivot table
-        pivot_df = self.df.pivot_table(
-            index=['Tanggal Sampling', 'Kode Testpit', 'Grid', 'Prospek', 'Penggali', 'Pemilik Lahan'],
-            values=['Tarif Galian', 'Tarif Samplingan', 'Tarif Timbunan',
-                    'Tarif Kompensasi', 'Tarif Angkutan', 'Tarif Langsiran'],
-            aggfunc='sum',
-            fill_value=0
-        ).reset_index()
-        
-            
-        # Select numeric columns as a list
-        numeric_cols = list(pivot_df.select_dtypes(include='number').columns)
-    
-        # Add Total column (row-wise sum)
-        pivot_df['Total'] = pivot_df[numeric_cols].sum(axis=1)
-    
-        # Create total row
-        total_values = pivot_df[numeric_cols + ['Total']].sum(axis=0)
-        total_row = {col: total_values.get(col, None) for col in pivot_df.columns}
-    
-        # Fill non-numeric columns with "Total"
-        for col in pivot_df.columns:
-            if col not in numeric_cols and col != 'Total':
+        return self.get_rollup().summary_table()
+
+
+class PaymentRollup:
+    # Rekap pembayaran dari satu groupby: per TPID, lalu total per Prospek/Penggali/Pemilik/Tanggal
+    # diturunkan dari tabel per TPID (bukan dari data mentah lagi). Semua frame tetap bertipe asli.
+    KEYS = ['Tanggal Sampling', 'Kode Testpit', 'Grid', 'Prospek', 'Penggali', 'Pemilik Lahan']
+    TARIF_COLUMNS = ['Tarif Angkutan', 'Tarif Galian', 'Tarif Kompensasi',
+                     'Tarif Langsiran', 'Tarif Samplingan', 'Tarif Timbunan']
+    LEVELS = {
+        "prospek": "Prospek",
+        "penggali": "Penggali",
+        "pemilik": "Pemilik Lahan",
+        "tanggal": "Tanggal Sampling",
+    }
+
+    def __init__(self, df):
+        per_tpid = df.groupby(self.KEYS, observed=True, sort=True)[self.TARIF_COLUMNS].sum().reset_index()
+
+        # Sama seperti pivot lama: kolom numerik setelah reset_index ikut dijumlahkan ke Total
+        self.numeric_cols = list(per_tpid.select_dtypes(include='number').columns)
+        per_tpid['Total'] = per_tpid[self.numeric_cols].sum(axis=1)
+        self.per_tpid = per_tpid
+
+        value_cols = self.numeric_cols + ['Total']
+        self.totals = {
+            level: per_tpid.groupby(col, observed=True, sort=True)[value_cols].sum().reset_index()
+            for level, col in self.LEVELS.items()
+        }
+        self.grand_total = per_tpid[value_cols].sum(axis=0)
+        self._summary = None
+
+    def by(self, level):
+        return self.totals[level]
+
+    def summary_table(self):
+        # Format lama get_pivot_summary: kolom kunci sebagai teks + baris "Total" di bawah
+        if self._summary is not None:
+            return self._summary
+        value_cols = self.numeric_cols + ['Total']
+        summary = self.per_tpid.copy()
+        total_row = {}
+        for col in summary.columns:
+            if col in value_cols:
+                total_row[col] = self.grand_total[col]
+            else:
                 total_row[col] = 'Total'
-                
-        for col in pivot_df.columns:
-            if col not in numeric_cols + ['Total']:
-                pivot_df[col] = pivot_df[col].astype(str)
-    
-        # Append as a new row (numeric index stays clean)
-        pivot_df = pd.concat([pivot_df, pd.DataFrame([total_row])], ignore_index=True)
-    
-        return pivot_df
+                summary[col] = summary[col].astype(str)
+        self._summary = pd.concat([summary, pd.DataFrame([total_row])], ignore_index=True)
+        return self._summary
+
+# Style bersama untuk semua sheet, dibuat sekali
+BOLD_FONT = Font(bold=True)
+CENTER_ALIGN = Alignment(horizontal="center", vertical="center")
+LEFT_ALIGN = Alignment(horizontal="left")
+THIN_BORDER = Border(left=Side(style="thin"), right=Side(style="thin"),
+                     top=Side(style="thin"), bottom=Side(style="thin"))
+HEADER_FILL = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")
+RUPIAH_STYLE = "rupiah_style"
+
+CELL_STYLES = {
+    "title": {"font": Font(bold=True, size=14), "alignment": CENTER_ALIGN},
+    "subtitle": {"font": Font(bold=True, size=12), "alignment": CENTER_ALIGN},
+    "left": {"alignment": LEFT_ALIGN},
+    "center": {"alignment": CENTER_ALIGN},
+    "header": {"font": BOLD_FONT, "alignment": CENTER_ALIGN, "border": THIN_BORDER, "fill": HEADER_FILL},
+    "data": {"alignment": CENTER_ALIGN, "border": THIN_BORDER},
+    "label": {"font": BOLD_FONT, "alignment": CENTER_ALIGN, "border": THIN_BORDER},
+    "rupiah": {"style": RUPIAH_STYLE},
+    "date": {"alignment": CENTER_ALIGN, "border": THIN_BORDER, "number_format": "yyyy-mm-dd"},
+}
+
+
+def register_styles(ws):
+    # Daftarkan semua style ke workbook dengan urutan tetap, sehingga indeks style sama di setiap
+    # workbook (dibutuhkan saat sheet dirender terpisah lalu digabung). Hasil: style -> StyleArray.
+    wb = ws.parent
+    if RUPIAH_STYLE not in wb.named_styles:
+        rp_style = NamedStyle(name=RUPIAH_STYLE)
+        rp_style.number_format = '"Rp."#,##0'
+        rp_style.alignment = CENTER_ALIGN
+        rp_style.border = THIN_BORDER
+        wb.add_named_style(rp_style)
+
+    style_arrays = {}
+    for style, attrs in CELL_STYLES.items():
+        prototype = WriteOnlyCell(ws)
+        for attr, value in attrs.items():
+            setattr(prototype, attr, value)
+        wb._cell_styles.add(prototype._style)
+        style_arrays[style] = prototype._style
+    return style_arrays
+
+
+# Mode yang baris tiap grupnya diurutkan per Pemilik Lahan
+SORT_BY_OWNER = ("timbunan", "angkutan", "kompensasi")
+
+
+class SheetBlock:
+    # Satu tabel bukti pembayaran yang siap ditulis: nama grup, nilai per kolom (urutan baris final),
+    # total harga, dan subtotal kompensasi {indeks baris: jumlah}
+    def __init__(self, name, columns, total, subtotals=None):
+        self.name = name
+        self.columns = columns
+        self.total = total
+        self.subtotals = subtotals or {}
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
 
 class MultiPaymentExcel:
+    # Mode-specific config
+    MODE_CONFIG = {
+        "gali": {
+            "title": "PENGGALIAN TEST PIT",
+            "uraian": "Untuk Pembayaran Penggalian Test Pit sbb :",
+            "headers": ["No", "Tgl. Selesai", "Kode Tespit", "Kedalaman (m)", "Harga Borongan"],
+            "harga_col": 6,
+            "subtotal": False,
+        },
+        "sampling": {
+            "title": "PENYAMPLINGAN TEST PIT",
+            "uraian": "Untuk Pembayaran Penyamplingan Test Pit sbb :",
+            "headers": ["No", "Tgl. Selesai", "Kode Tespit", "Total Koli", "Harga Borongan"],
+            "harga_col": 6,
+            "subtotal": False,
+        },
+        "timbunan": {
+            "title": "PEMBAYARAN TIMBUNAN TEST PIT",
+            "uraian": "Untuk Pembayaran Timbunan Test Pit sbb :",
+            "headers": ["No", "Tgl. Selesai", "Kode Tespit", "Grid", "Pemilik Lahan", "Kedalaman (m)", "Harga Borongan", "TTD"],
+            "harga_col": 8,
+            "subtotal": False,
+        },
+        "kompensasi": {
+            "title": "PEMBAYARAN KOMPENSASI LAHAN",
+            "uraian": "Untuk Pembayaran Kompensasi Lahan sbb :",
+            "headers": ["No", "Tgl. Selesai", "Kode Tespit", "Grid", "Pemilik Lahan", "Harga Kompensasi", "Total Kompensasi", "TTD"],
+            "harga_col": 7,
+            "subtotal": True,
+        },
+        "angkutan": {
+            "title": "PEMBAYARAN ANGKUTAN SAMPEL",
+            "uraian": "Untuk Pembayaran Angkutan Sampel sbb :",
+            "headers": ["No", "Tgl. Selesai", "Kode Tespit", "Grid", "Pemilik Lahan", "Harga Angkutan", "TTD"],
+            "harga_col": 7,
+            "subtotal": False,
+        },
+        "langsiran": {
+            "title": "PEMBAYARAN LANGSIRAN SAMPEL",
+            "uraian": "Untuk Pembayaran Langsiran Sampel sbb :",
+            "headers": ["No", "Tgl. Selesai", "Kode Tespit", "Grid", "Pemilik Lahan", "Harga Langsiran", "TTD"],
+            "harga_col": 7,
+            "subtotal": False,
+        }
+
+    }
+
     def __init__(
         self,
         ws,
-        data_rows: List[List[List[Union[str, float, int]]]],
-        group_names: List[str],
+        blocks: List[SheetBlock],
         date_text: str = "Setabar, 26 Juni 2025",
         signers: dict = None ,
         receiver_title: str = "Area",
@@ -268,301 +608,309 @@ class MultiPaymentExcel:
                 "D": ("Rizky Lambas", "Geologist"),
             }        
         self.ws = ws
-        self.data_rows = data_rows
-        self.group_names = group_names
+        self.blocks = blocks
         self.signers = signers
         self.date_text = date_text
         self.receiver_title = receiver_title
         self.mode = mode.lower()
+        self._style_arrays = None
 
-    def generate_excel(self):
-        ws = self.ws
+    def _layout(self):
+        # Hasilkan baris sheet berurutan: (nomor baris, [(kolom, nilai, style)], kolom akhir merge atau None)
+        config = self.MODE_CONFIG[self.mode]
+        last_col = len(config["headers"]) + 1
         current_row = 1
 
-        # Styles
-        bold_font = Font(bold=True)
-        center_align = Alignment(horizontal="center", vertical="center")
-        left_align = Alignment(horizontal="left")
-        thin_border = Border(left=Side(style="thin"), right=Side(style="thin"),
-                             top=Side(style="thin"), bottom=Side(style="thin"))
-        header_fill = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")
+        for block in self.blocks:
+            group_name = block.name
 
-        rp_style = NamedStyle(name="rupiah_style")
-        rp_style.number_format = '"Rp."#,##0'
-        rp_style.alignment = center_align
-        rp_style.border = thin_border
-        if "rupiah_style" not in ws.parent.named_styles:
-            ws.parent.add_named_style(rp_style)
-
-        # Mode-specific config
-        mode_config = {
-            "gali": {
-                "title": "PENGGALIAN TEST PIT",
-                "uraian": "Untuk Pembayaran Penggalian Test Pit sbb :",
-                "headers": ["No", "Tgl. Selesai", "Kode Tespit", "Kedalaman (m)", "Harga Borongan"],
-                "harga_col": 6,
-                "subtotal": False,
-            },
-            "sampling": {
-                "title": "PENYAMPLINGAN TEST PIT",
-                "uraian": "Untuk Pembayaran Penyamplingan Test Pit sbb :",
-                "headers": ["No", "Tgl. Selesai", "Kode Tespit", "Total Koli", "Harga Borongan"],
-                "harga_col": 6,
-                "subtotal": False,
-            },
-            "timbunan": {
-                "title": "PEMBAYARAN TIMBUNAN TEST PIT",
-                "uraian": "Untuk Pembayaran Timbunan Test Pit sbb :",
-                "headers": ["No", "Tgl. Selesai", "Kode Tespit", "Grid", "Pemilik Lahan", "Kedalaman (m)", "Harga Borongan", "TTD"],
-                "harga_col": 8,
-                "subtotal": False,
-            },
-            "kompensasi": {
-                "title": "PEMBAYARAN KOMPENSASI LAHAN",
-                "uraian": "Untuk Pembayaran Kompensasi Lahan sbb :",
-                "headers": ["No", "Tgl. Selesai", "Kode Tespit", "Grid", "Pemilik Lahan", "Harga Kompensasi", "Total Kompensasi", "TTD"],
-                "harga_col": 7,
-                "subtotal": True,
-            },
-            "angkutan": {
-                "title": "PEMBAYARAN ANGKUTAN SAMPEL",
-                "uraian": "Untuk Pembayaran Angkutan Sampel sbb :",
-                "headers": ["No", "Tgl. Selesai", "Kode Tespit", "Grid", "Pemilik Lahan", "Harga Angkutan", "TTD"],
-                "harga_col": 7,
-                "subtotal": False,
-            },
-            "langsiran": {
-                "title": "PEMBAYARAN LANGSIRAN SAMPEL",
-                "uraian": "Untuk Pembayaran Langsiran Sampel sbb :",
-                "headers": ["No", "Tgl. Selesai", "Kode Tespit", "Grid", "Pemilik Lahan", "Harga Langsiran", "TTD"],
-                "harga_col": 7,
-                "subtotal": False,
-            }
-            
-        }
+            yield current_row, [(2, "BUKTI PEMBAYARAN", "title")], last_col
+            yield current_row + 1, [(2, config["title"], "subtitle")], last_col
+            yield current_row + 2, [(2, "Sudah Terima Dari : Tim Eksplorasi Bauksit Kalbar", "left")], last_col
+            current_row += 4
 
-        config = mode_config[self.mode]
+            yield current_row, [(2, config["uraian"], "left")], last_col
+            current_row += 1
 
-        for table_index, table_rows in enumerate(self.data_rows):
-            group_name = self.group_names[table_index]
+            yield current_row, [(col, header, "header") for col, header in enumerate(config["headers"], start=2)], None
+            current_row += 1
 
-            for title in ["BUKTI PEMBAYARAN", config["title"]]:
-                ws.merge_cells(start_row=current_row, start_column=2, end_row=current_row, end_column=len(config["headers"]) + 1)
-                cell = ws.cell(row=current_row, column=2, value=title)
-                cell.font = Font(bold=True, size=14 if title == "BUKTI PEMBAYARAN" else 12)
-                cell.alignment = center_align
+            padding = [""] * (len(config["headers"]) - 1 - len(block.columns))
+            for i, values in enumerate(zip(*block.columns)):
+                cells = [(2, i + 1, "data")]
+                for col, val in enumerate([*values, *padding], start=3):
+                    if col == 8 and i in block.subtotals:
+                        cells.append((col, block.subtotals[i], "rupiah"))
+                    elif col == config["harga_col"]:
+                        cells.append((col, val, "rupiah"))
+                    else:
+                        # Tanggal tetap datetime sampai ke sel (format yyyy-mm-dd), tidak lewat teks
+                        cells.append((col, val, "date" if isinstance(val, datetime) else "data"))
+                yield current_row, cells, None
                 current_row += 1
 
-            ws.merge_cells(start_row=current_row, start_column=2, end_row=current_row, end_column=len(config["headers"]) + 1)
-            ws.cell(row=current_row, column=2, value="Sudah Terima Dari : Tim Eksplorasi Bauksit Kalbar").alignment = left_align
+            # Grand total row
+            yield current_row, [(config["harga_col"] - 1, "TOTAL", "label"), (config["harga_col"], block.total, "rupiah")], None
             current_row += 2
 
-            ws.merge_cells(start_row=current_row, start_column=2, end_row=current_row, end_column=len(config["headers"]) + 1)
-            ws.cell(row=current_row, column=2, value=config["uraian"]).alignment = left_align
-            current_row += 1
+            if self.mode in ["gali", "sampling"]:
+                columns = (2, 4, 6)
+                date_col, receiver_label, receiver_title = 5, "Yang Menerima,", "Ketua Kelompok"
+            elif self.mode in ["kompensasi", "timbunan", "angkutan"]:
+                columns = (2, 5, 8)
+                date_col, receiver_label, receiver_title = 7, "Lokasi,", self.receiver_title
+            else:
+                continue
 
-            for col_index, header in enumerate(config["headers"], start=2):
-                cell = ws.cell(row=current_row, column=col_index, value=header)
-                cell.font = bold_font
-                cell.alignment = center_align
-                cell.border = thin_border
-                cell.fill = header_fill
-                ws.column_dimensions[get_column_letter(col_index)].width = len(header) + 5
+            payer_col, field_col, receiver_col = columns
+            yield current_row, [(date_col, self.date_text, "left")], None
             current_row += 1
+            yield current_row, [(payer_col, "Dibayar Oleh,", "center"), (field_col, "Pet. Lapangan,", "center"),
+                                (receiver_col, receiver_label, "center")], None
+            current_row += 5
+            yield current_row, [(payer_col, self.signers["B"][0], "center"), (field_col, self.signers["D"][0], "center"),
+                                (receiver_col, group_name, "center")], None
+            current_row += 1
+            yield current_row, [(payer_col, self.signers["B"][1], "center"), (field_col, self.signers["D"][1], "center"),
+                                (receiver_col, receiver_title, "center")], None
+            current_row += 4
 
-            total_harga = 0
-            start_data_row = current_row
-            # Sort table_rows based on mode category
-            if self.mode in ["gali", "sampling"]:
-                table_rows
-            elif self.mode in ["timbunan", "angkutan", "kompensasi"]:
-                # Sort by pemilik lahan (index 4)
-                table_rows.sort(key=lambda x: str(x[4]).strip().lower())
-
-            for i, row_data in enumerate(table_rows):
-                row_data[0] = i + 1
-                while len(row_data) < len(config["headers"]):
-                    row_data.append("")
-                for j, val in enumerate(row_data):
-                    col = j + 2
-                    cell = ws.cell(row=current_row, column=col, value=val)
-                    cell.alignment = center_align
-                    cell.border = thin_border
-                    if col == config["harga_col"]:
-                        cell.style = "rupiah_style"
-                if isinstance(row_data[config["harga_col"] - 2], (int, float)):
-                    total_harga += row_data[config["harga_col"] - 2]
-                current_row += 1
+    def _set_column_widths(self, ws):
+        if not self.blocks:
+            return
+        for col_index, header in enumerate(self.MODE_CONFIG[self.mode]["headers"], start=2):
+            ws.column_dimensions[get_column_letter(col_index)].width = len(header) + 5
 
-            # Subtotal for kompensasi
-            if self.mode == "kompensasi":
-                owner_row_map = defaultdict(list)
-                for idx, row_data in enumerate(table_rows):
-                    owner = str(row_data[4]).strip()
-                    owner_row_map[owner].append(start_data_row + idx)
-                for owner, rows in owner_row_map.items():
-                    subtotal = 0
-                    for row in rows:
-                        cell = ws.cell(row=row, column=7)
-                        if isinstance(cell.value, (int, float)):
-                            subtotal += cell.value
-                    ws.cell(row=rows[0], column=8, value=subtotal).style = "rupiah_style"
+    def generate_excel(self):
+        ws = self.ws
+        self._style_arrays = register_styles(ws)
+        if isinstance(ws, WriteOnlyWorksheet):
+            return self._stream_excel(ws)
+
+        self._set_column_widths(ws)
+        for row, cells, merge_end in self._layout():
+            if merge_end:
+                ws.merge_cells(start_row=row, start_column=2, end_row=row, end_column=merge_end)
+            for col, value, style in cells:
+                ws.cell(row=row, column=col, value=value)._style = StyleArray(self._style_arrays[style])
+
+    def _stream_excel(self, ws):
+        # Mode write-only: baris ditulis berurutan, lebar kolom harus diset sebelum baris pertama
+        self._set_column_widths(ws)
+        written = 0
+        for row, cells, merge_end in self._layout():
+            while written < row - 1:
+                ws.append([])
+                written += 1
+            if merge_end:
+                ws.merged_cells.add(CellRange(min_col=2, min_row=row, max_col=merge_end, max_row=row))
+
+            values = [None] * cells[-1][0]
+            for col, value, style in cells:
+                values[col - 1] = Cell(ws, row=row, column=col, value=value, style_array=self._style_arrays[style])
+            ws.append(values)
+            written += 1
+
+def _render_sheet_part(df, config, date_text, signers, tab_selected):
+    # Dijalankan di proses worker: render satu sheet ke workbook sendiri, kembalikan XML sheet-nya
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(config["sheet"])
+    if not tab_selected:
+        ws.sheet_view.tabSelected = None
+    PaymentExcelBuilder._render_sheet(ws, df, config, date_text, signers)
+
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    with zipfile.ZipFile(buffer) as archive:
+        return archive.read("xl/worksheets/sheet1.xml")
 
-            # Grand total row
-            total_label_col = config["harga_col"] - 1
-            label_cell = ws.cell(row=current_row, column=total_label_col, value="TOTAL")
-            label_cell.font = bold_font
-            label_cell.alignment = center_align
-            label_cell.border = thin_border
 
-            total_cell = ws.cell(row=current_row, column=config["harga_col"], value=total_harga)
-            total_cell.style = "rupiah_style"
+class PaymentExcelBuilder:
+    SHEET_CONFIGS = [
+        {
+            "sheet": "Galian",
+            "mode": "gali",
+            "group_col": "Penggali",
+            "columns": ["Penggali", "Tanggal Sampling", "Kode Testpit", "Total Kedalaman", "Tarif Galian"],
+            "rename": {"Tarif Galian": "tarif"},
+            "values": ["Tanggal Sampling", "Kode Testpit", "Total Kedalaman", "tarif"]
+        },
+        {
+            "sheet": "Samplingan",
+            "mode": "sampling",
+            "group_col": "Penggali",
+            "columns": ["Penggali", "Tanggal Sampling", "Kode Testpit", "Total Koli", "Tarif Samplingan"],
+            "rename": {"Tarif Samplingan": "tarif"},
+            "values": ["Tanggal Sampling", "Kode Testpit", "Total Koli", "tarif"]
+        },
+        {
+            "sheet": "Timbunan",
+            "mode": "timbunan",
+            "group_col": "Prospek",
+            "columns": ["Prospek", "Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "Total Kedalaman", "Tarif Timbunan"],
+            "rename": {"Tarif Timbunan": "harga"},
+            "values": ["Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "Total Kedalaman", "harga"]
+        },
+        {
+            "sheet": "Kompensasi",
+            "mode": "kompensasi",
+            "group_col": "Prospek",
+            "columns": ["Prospek", "Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "Tarif Kompensasi"],
+            "rename": {"Tarif Kompensasi": "harga"},
+            "values": ["Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "harga"]
+        },
+        {
+            "sheet": "Angkutan",
+            "mode": "angkutan",
+            "group_col": "Prospek",
+            "columns": ["Prospek", "Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "Tarif Angkutan"],
+            "rename": {"Tarif Angkutan": "harga"},
+            "values": ["Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "harga"]
+        },
+        {   "sheet": "Langsiran",
+            "mode": "langsiran",
+            "group_col": "Prospek",
+            "columns": ["Prospek", "Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "Tarif Langsiran"],
+            "rename": {"Tarif Langsiran": "harga"},
+            "values": ["Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "harga"]
+        }
 
-            current_row += 2
+    ]
+
+    def __init__(self, df: pd.DataFrame, instrumentation=None):
+        self.instrumentation = instrumentation or Instrumentation()
+        self.df = self._fill_missing(df.sort_values(by=["Kelompok Penggali", 'Penggali']))
+
+    @staticmethod
+    def _fill_missing(df):
+        # Nilai kosong ditulis sebagai 0; kolom kategori perlu kategori 0 dulu sebelum fillna
+        missing = [col for col in df.columns if df[col].isna().any()]
+        for col in missing:
+            if isinstance(df[col].dtype, pd.CategoricalDtype) and 0 not in df[col].cat.categories:
+                df[col] = df[col].cat.add_categories([0])
+        return df.fillna({col: 0 for col in missing})
+
+    @staticmethod
+    def _group_data(df, group_col, columns, rename_map, values_structure, mode: str):
+        # Satu sort per sheet: grup (ID entitas) dalam urutan kemunculan pertama, lalu (timbunan/angkutan/
+        # kompensasi) Pemilik Lahan menurut kunci trim + casefold secara stabil. Batas grup dari indeks
+        # array; total per grup dan subtotal per pemilik (kompensasi) dihitung sebagai array, bukan per baris.
+        data = df[columns].rename(columns=rename_map)
+        if data.empty:
+            return []
+        # ID entitas dari kamus kolom (tanpa normalisasi ulang), lalu urutan kemunculan pertama
+        group_codes, _ = pd.factorize(entity_ids(data[group_col])[1])
+        harga_col = values_structure[-1]
+
+        if mode in SORT_BY_OWNER:
+            owners, owner_ids = entity_ids(data[values_structure[3]])
+            order = np.lexsort((owners.sort_ranks()[owner_ids], group_codes))
+        else:
+            order = np.argsort(group_codes, kind="stable")
+
+        sorted_codes = group_codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+
+        names = data[group_col].take(order[starts]).tolist()
+        value_lists = [data[col].take(order).tolist() for col in values_structure]
+        harga = pd.to_numeric(data[harga_col], errors="coerce").fillna(0).to_numpy()[order]
+        totals = np.add.reduceat(harga, starts).tolist()
+
+        subtotals = [{} for _ in starts]
+        if mode == "kompensasi":
+            # Subtotal per pemilik (ID entitas) di baris pertama pemilik itu dalam grup
+            owner_key = owner_ids[order]
+            block = np.repeat(np.arange(len(starts)), ends - starts)
+            per_owner = pd.DataFrame({"block": block, "owner": owner_key, "harga": harga}) \
+                .groupby(["block", "owner"], sort=False)
+            first = per_owner.cumcount().to_numpy() == 0
+            owner_totals = per_owner["harga"].transform("sum").to_numpy()
+            for position in np.flatnonzero(first):
+                subtotals[block[position]][int(position - starts[block[position]])] = owner_totals[position].item()
+
+        return [
+            SheetBlock(names[b], [values[start:end] for values in value_lists], totals[b], subtotals[b])
+            for b, (start, end) in enumerate(zip(starts.tolist(), ends.tolist()))
+        ]
+
+    @classmethod
+    def _render_sheet(cls, ws, df, config, date_text, signers):
+        blocks = cls._group_data(
+            df,
+            config["group_col"],
+            config["columns"],
+            config["rename"],
+            config["values"],
+            config["mode"]
+        )
+        report = MultiPaymentExcel(
+            ws,
+            blocks,
+            date_text=date_text,
+            signers=signers,
+            mode=config["mode"]
+        )
+        report.generate_excel()
 
-            if self.mode in ["gali", "sampling"]:
-                ws.cell(row=current_row, column=5, value=self.date_text).alignment = left_align
-                current_row += 1
-                ws.cell(row=current_row, column=2, value="Dibayar Oleh,").alignment = center_align
-                ws.cell(row=current_row, column=4, value="Pet. Lapangan,").alignment = center_align
-                ws.cell(row=current_row, column=6, value="Yang Menerima,").alignment = center_align
-                current_row += 5
-            
-                ws.cell(row=current_row, column=2, value=self.signers["B"][0]).alignment = center_align
-                ws.cell(row=current_row, column=4, value=self.signers["D"][0]).alignment = center_align
-                ws.cell(row=current_row, column=6, value=group_name).alignment = center_align
-                current_row += 1
-            
-                ws.cell(row=current_row, column=2, value=self.signers["B"][1]).alignment = center_align
-                ws.cell(row=current_row, column=4, value=self.signers["D"][1]).alignment = center_align
-                ws.cell(row=current_row, column=6, value="Ketua Kelompok").alignment = center_align
-                current_row += 4
-
-            if self.mode in ["kompensasi", "timbunan", "angkutan"]:
-                ws.cell(row=current_row, column=7, value=self.date_text).alignment = left_align
-                current_row += 1
-                ws.cell(row=current_row, column=2, value="Dibayar Oleh,").alignment = center_align
-                ws.cell(row=current_row, column=5, value="Pet. Lapangan,").alignment = center_align
-                ws.cell(row=current_row, column=8, value="Lokasi,").alignment = center_align
-                current_row += 5
-            
-                ws.cell(row=current_row, column=2, value=self.signers["B"][0]).alignment = center_align
-                ws.cell(row=current_row, column=5, value=self.signers["D"][0]).alignment = center_align
-                ws.cell(row=current_row, column=8, value=group_name).alignment = center_align
-                current_row += 1
-            
-                ws.cell(row=current_row, column=2, value=self.signers["B"][1]).alignment = center_align
-                ws.cell(row=current_row, column=5, value=self.signers["D"][1]).alignment = center_align
-                ws.cell(row=current_row, column=8, value=self.receiver_title).alignment = center_align
-                current_row += 4
-                
-class PaymentExcelBuilder:
-    def __init__(self, df: pd.DataFrame):
-        self.df = df.sort_values(by=["Kelompok Penggali", 'Penggali']).copy()
-        self.df.fillna(0, inplace=True)
-        
-    def _group_data(self, group_col, columns, rename_map, values_structure, mode: str):
-        raw_data = self.df[columns].rename(columns=rename_map)
-        raw_data_list = raw_data.to_dict(orient="records")
-    
-        grouped = defaultdict(list)
-        for entry in raw_data_list:
-            row = [
-                None,
-                *[entry[col] for col in values_structure]
-            ]
-    
-            # Add signature column only for kompensasi or timbunan
-            if mode in ("kompensasi", "timbunan", "angkutan"):
-                row.append("")
-    
-            grouped[entry[group_col]].append(row)
-    
-        tables = list(grouped.values())
-        names = list(grouped.keys())
-        return tables, names
     def create_multi_payment_excel(
         self,
         output_file: str,
         date_text: str = "Setabar, 26 Juni 2025",
-        signers: dict = None
+        signers: dict = None,
+        streaming: bool = False,
+        workers: int = 1
     ):
         if signers is None:
             signers = {
                 "B": ("Chandra Ardiansyah", "Keu. / Umum"),
                 "D": ("Rizky Lambas", "Geologist"),
             }
-        wb = Workbook()
-        wb.remove(wb.active)
-
-        configs = [
-            {
-                "sheet": "Galian",
-                "mode": "gali",
-                "group_col": "Penggali",
-                "columns": ["Penggali", "Tanggal Sampling", "Kode Testpit", "Total Kedalaman", "Tarif Galian"],
-                "rename": {"Tarif Galian": "tarif"},
-                "values": ["Tanggal Sampling", "Kode Testpit", "Total Kedalaman", "tarif"]
-            },
-            {
-                "sheet": "Samplingan",
-                "mode": "sampling",
-                "group_col": "Penggali",
-                "columns": ["Penggali", "Tanggal Sampling", "Kode Testpit", "Total Koli", "Tarif Samplingan"],
-                "rename": {"Tarif Samplingan": "tarif"},
-                "values": ["Tanggal Sampling", "Kode Testpit", "Total Koli", "tarif"]
-            },
-            {
-                "sheet": "Timbunan",
-                "mode": "timbunan",
-                "group_col": "Prospek",
-                "columns": ["Prospek", "Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "Total Kedalaman", "Tarif Timbunan"],
-                "rename": {"Tarif Timbunan": "harga"},
-                "values": ["Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "Total Kedalaman", "harga"]
-            },
-            {
-                "sheet": "Kompensasi",
-                "mode": "kompensasi",
-                "group_col": "Prospek",
-                "columns": ["Prospek", "Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "Tarif Kompensasi"],
-                "rename": {"Tarif Kompensasi": "harga"},
-                "values": ["Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "harga"]
-            },
-            {
-                "sheet": "Angkutan",
-                "mode": "angkutan",
-                "group_col": "Prospek",
-                "columns": ["Prospek", "Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "Tarif Angkutan"],
-                "rename": {"Tarif Angkutan": "harga"},
-                "values": ["Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "harga"]
-            },
-            {   "sheet": "Langsiran",
-                "mode": "langsiran",
-                "group_col": "Prospek",
-                "columns": ["Prospek", "Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "Tarif Langsiran"],
-                "rename": {"Tarif Langsiran": "harga"},
-                "values": ["Tanggal Sampling", "Kode Testpit", "Grid", "Pemilik Lahan", "harga"]
-            }
-            
-        ]
+        if workers > 1:
+            return self._create_parallel(output_file, date_text, signers, workers)
 
-        for config in configs:
-            tables, names = self._group_data(
-                config["group_col"],
-                config["columns"],
-                config["rename"],
-                config["values"],
-                config["mode"]
-            )
+        # streaming=True memakai workbook write-only: baris langsung ditulis, memori tetap datar
+        if streaming:
+            wb = Workbook(write_only=True)
+        else:
+            wb = Workbook()
+            wb.remove(wb.active)
+
+        for config in self.SHEET_CONFIGS:
             ws = wb.create_sheet(config["sheet"])
-            report = MultiPaymentExcel(
-                ws,
-                tables,
-                names,
-                date_text=date_text,
-                signers=signers,
-                mode=config["mode"]
-            )
-            report.generate_excel()
-
-        wb.save(output_file)
+            with self.instrumentation.stage(f"PaymentExcelBuilder.sheet[{config['sheet']}]", rows_in=len(self.df)):
+                self._render_sheet(ws, self.df, config, date_text, signers)
+
+        with self.instrumentation.stage("PaymentExcelBuilder.save"):
+            wb.save(output_file)
+
+    def to_bytes(self, date_text: str = "Setabar, 26 Juni 2025", signers: dict = None,
+                 streaming: bool = True, workers: int = 1) -> bytes:
+        # Render langsung ke memori, tanpa file di direktori kerja
+        buffer = io.BytesIO()
+        self.create_multi_payment_excel(buffer, date_text=date_text, signers=signers,
+                                        streaming=streaming, workers=workers)
+        return buffer.getvalue()
+
+    def _create_parallel(self, output_file, date_text, signers, workers):
+        # Setiap sheet dirender di proses terpisah (mode write-only), lalu XML sheet-nya
+        # dipasang ke kerangka workbook yang punya style dan urutan sheet yang sama.
+        with self.instrumentation.stage("PaymentExcelBuilder.parallel_render", rows_in=len(self.df)), \
+                ProcessPoolExecutor(max_workers=min(workers, len(self.SHEET_CONFIGS))) as pool:
+            futures = [
+                pool.submit(_render_sheet_part, self.df[config["columns"]], config, date_text, signers, index == 0)
+                for index, config in enumerate(self.SHEET_CONFIGS)
+            ]
+
+            skeleton = Workbook(write_only=True)
+            for config in self.SHEET_CONFIGS:
+                register_styles(skeleton.create_sheet(config["sheet"]))
+            skeleton_buffer = io.BytesIO()
+            skeleton.save(skeleton_buffer)
+
+            parts = {f"xl/worksheets/sheet{index}.xml": future.result() for index, future in enumerate(futures, start=1)}
+
+        with zipfile.ZipFile(skeleton_buffer) as source, \
+                zipfile.ZipFile(output_file, "w", zipfile.ZIP_DEFLATED) as target:
+            for item in source.infolist():
+                target.writestr(item, parts.get(item.filename) or source.read(item.filename))
@@ -0,0 +1,232 @@
+import os
+
+import pandas as pd
+
+from cache import fingerprint_frame
+from dates import parse_dates
+from delta import PricedStore, price_incremental
+from entities import entity_ids
+from instrumentation import Instrumentation, count_rows
+from modul import ConfigurationInput, PaymentCount, PriceIndex
+from tarif import TariffConfig
+from validation import validate_for_pricing
+
+PRICE_FILES = {
+    "harga_galian_lokal": ("hg_galian_lokal.csv", "Kedalaman"),
+    "harga_galian_luar": ("hg_galian_luar.csv", "Kedalaman"),
+    "harga_samplingan_lokal": ("hg_samplingan_lokal.csv", "Total Koli"),
+    "harga_samplingan_luar": ("hg_samplingan_luar.csv", "Total Koli"),
+}
+
+
+def load_price_tables(directory="."):
+    # Tabel harga dikompilasi sekali menjadi PriceIndex, urutan sesuai argumen PaymentCount
+    return [
+        PriceIndex(pd.read_csv(os.path.join(directory, filename)), key_col)
+        for filename, key_col in PRICE_FILES.values()
+    ]
+
+
+def load_tariff_config(path="tarif.json"):
+    # Konfigurasi tarif deklaratif (semua IUP); None jika file tidak ada
+    if not path or not os.path.exists(path):
+        return None
+    return TariffConfig.load(path)
+
+
+def load_tariffs(path="tarif.json", iup=None):
+    # TariffSet untuk satu IUP; None jika file tidak ada (PaymentCount memakai tarif bawaan)
+    config = load_tariff_config(path)
+    return config.resolve(iup) if config is not None else None
+
+
+def merge_stage3_with_stage2(stage3_df, stage2_df):
+    if stage3_df is None or stage2_df is None:
+        return stage3_df
+    # Join lewat ID Penggali (trim + casefold), jadi "Budi " di template tetap cocok dengan "budi" di data.
+    # Nama yang sama lebih dari sekali di template -> baris pertama yang dipakai (tidak menggandakan baris).
+    entities, penggali_ids = entity_ids(stage3_df["Penggali"])
+    left = stage3_df.assign(_penggali_id=penggali_ids)
+    right = stage2_df.drop(columns="Penggali").assign(_penggali_id=entities.lookup(stage2_df["Penggali"]))
+    right = right[right["_penggali_id"] >= 0].drop_duplicates(subset="_penggali_id", keep="first")
+    return pd.merge(left, right, how="left", on="_penggali_id").drop(columns="_penggali_id")
+
+
+def read_location_template(source, name=""):
+    if str(name).endswith(".xlsx"):
+        stage1_df = pd.read_excel(source)
+    else:
+        stage1_df = pd.read_csv(source)
+
+    date_cols = [
+        "Tanggal Mulai (2025-05-23)",
+        "Tanggal Selesai (2025-05-23)",
+        "Tanggal Gajian (2025-05-23)"
+    ]
+    for col in date_cols:
+        if col in stage1_df.columns:
+            stage1_df[col] = parse_dates(stage1_df[col], normalize=True)
+    return stage1_df
+
+
+def fingerprint_value(value):
+    if value is None:
+        return "none"
+    if isinstance(value, pd.DataFrame):
+        return fingerprint_frame(value)
+    return repr(value)
+
+
+class Stage:
+    def __init__(self, name, func, inputs):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+
+
+class StagePipeline:
+    # Setiap stage mendeklarasikan inputnya dan hanya dihitung ulang jika sidik jari input berubah.
+    # Sidik jari input = hash isi; sidik jari stage = gabungan sidik jari inputnya (tanpa hash output).
+    def __init__(self, store=None, instrumentation=None):
+        self.store = {} if store is None else store
+        self.instrumentation = instrumentation or Instrumentation()
+        self.stages = {}
+        self.fingerprints = {}
+        self.computed_from = {}
+
+    def add_input(self, name, value=None):
+        self.set_input(name, value)
+        return self
+
+    def add_stage(self, name, func, inputs):
+        for dep in inputs:
+            if dep not in self.stages and dep not in self.fingerprints:
+                raise ValueError(f"Stage '{name}' depends on unknown input '{dep}'")
+        self.stages[name] = Stage(name, func, inputs)
+        return self
+
+    def set_input(self, name, value, fingerprint=None):
+        # Kembalikan True jika nilai input berubah. fingerprint bisa diberikan langsung
+        # (mis. id file upload) supaya data besar tidak perlu di-hash ulang setiap rerun.
+        fingerprint = fingerprint or fingerprint_value(value)
+        if self.fingerprints.get(name) == fingerprint and name in self.store:
+            return False
+        self.store[name] = value
+        self.fingerprints[name] = fingerprint
+        return True
+
+    def _fingerprint(self, name):
+        if name not in self.stages:
+            return self.fingerprints[name]
+        stage = self.stages[name]
+        parts = [self._fingerprint(dep) for dep in stage.inputs]
+        return f"{name}({','.join(parts)})"
+
+    def get(self, name):
+        if name not in self.stages:
+            return self.store[name]
+
+        stage = self.stages[name]
+        fingerprint = self._fingerprint(name)
+        if self.computed_from.get(name) == fingerprint and name in self.store:
+            return self.store[name]
+
+        values = [self.get(dep) for dep in stage.inputs]
+        with self.instrumentation.stage(f"pipeline.{name}", rows_in=count_rows(values[0]) if values else None) as record:
+            self.store[name] = stage.func(*values)
+            record["rows_out"] = count_rows(self.store[name])
+        self.computed_from[name] = fingerprint
+        return self.store[name]
+
+    def detach(self, name):
+        # Input stage dihitung sekarang; stage-nya sendiri dikembalikan sebagai fungsi tanpa argumen yang
+        # tidak menyentuh state pipeline, jadi aman dijalankan di thread lain (job latar belakang)
+        stage = self.stages[name]
+        values = [self.get(dep) for dep in stage.inputs]
+        return lambda: stage.func(*values)
+
+
+def build_payment_pipeline(harga_galian_lokal=None, harga_galian_luar=None,
+                           harga_samplingan_lokal=None, harga_samplingan_luar=None,
+                           store=None, instrumentation=None, delta_store=None, ledger=None, period=None, iup=None,
+                           tariffs=None, drop_invalid=False, pricing_workers=1, tariff_config=None):
+    # delta_store (folder): testpit yang sudah dihitung pada run sebelumnya tidak dihitung ulang.
+    # ledger (PaymentLedger): testpit yang sudah dibayar di periode/IUP lain ditandai sebelum dihitung;
+    # period/iup adalah input pipeline (set_input) sehingga bisa diganti tanpa membangun ulang pipeline.
+    # tariffs (TariffSet): aturan tarif dari tarif.json; tanpa itu dipakai tabel harga + tarif bawaan.
+    # tariff_config (TariffConfig): menggantikan tariffs, di-resolve dari input "iup" (IUP bisa ganti per run).
+    # drop_invalid: baris dengan anomali (lihat stage "anomalies") tidak ikut dihitung.
+    # pricing_workers: jumlah proses untuk rantai harga_* pada data besar (hasil sama dengan serial).
+    instrumentation = instrumentation or Instrumentation()
+    priced_store = PricedStore(delta_store) if delta_store else None
+
+    def stage1(clean_data, lokasi_template):
+        if lokasi_template is not None:
+            return lokasi_template
+        return ConfigurationInput(instrumentation).process_stage1(clean_data)
+
+    def configure(clean_data, stage1):
+        # Stage 2 dan 3 memakai satu ConfigurationInput supaya filter lokasi/tanggal cukup sekali
+        config = ConfigurationInput(instrumentation)
+        return config.process_stage2(clean_data, stage1), config.process_stage3(clean_data, stage1)
+
+    def penggali(configured, penggali_template):
+        return penggali_template if penggali_template is not None else configured[0]
+
+    def tariff_set(iup):
+        return tariff_config.resolve(iup) if tariff_config is not None else tariffs
+
+    def new_processor(tariffs):
+        return PaymentCount(
+            harga_galian_lokal,
+            harga_galian_luar,
+            harga_samplingan_lokal,
+            harga_samplingan_luar,
+            instrumentation,
+            tariffs=tariffs,
+            workers=pricing_workers,
+        )
+
+    def validation(merged, tariffs):
+        # Dedupe + cek terhadap aturan tarif yang sama dengan yang dipakai PaymentCount
+        rows_in = len(merged) if merged is not None else None
+        with instrumentation.stage("validation", rows_in=rows_in) as record:
+            validated, anomalies = validate_for_pricing(merged, new_processor(tariffs).tariffs, drop_invalid)
+            record["rows_out"] = count_rows(validated)
+            record["anomalies"] = len(anomalies)
+        return validated, anomalies
+
+    def flagged(merged, period, iup):
+        if ledger is None or merged is None:
+            return merged
+        with instrumentation.stage("ledger.flag_paid", rows_in=len(merged)) as record:
+            merged = ledger.flag_paid(merged, exclude_period=period, exclude_iup=iup)
+            record["rows_out"] = len(merged)
+        return merged
+
+    def payment(merged, tariffs):
+        processor = new_processor(tariffs)
+        if priced_store is not None:
+            return price_incremental(processor, merged, priced_store)
+        processor.set_data(merged).price().get_result()
+        return processor
+
+    pipeline = StagePipeline(store, instrumentation)
+    pipeline.add_input("clean_data")
+    pipeline.add_input("lokasi_template")
+    pipeline.add_input("penggali_template")
+    pipeline.add_input("period", period)
+    pipeline.add_input("iup", iup)
+    pipeline.add_stage("tariffs", tariff_set, ["iup"])
+    pipeline.add_stage("stage1", stage1, ["clean_data", "lokasi_template"])
+    pipeline.add_stage("configured", configure, ["clean_data", "stage1"])
+    pipeline.add_stage("stage2", lambda configured: configured[0], ["configured"])
+    pipeline.add_stage("stage3", lambda configured: configured[1], ["configured"])
+    pipeline.add_stage("penggali", penggali, ["configured", "penggali_template"])
+    pipeline.add_stage("merged", merge_stage3_with_stage2, ["stage3", "penggali"])
+    pipeline.add_stage("validation", validation, ["merged", "tariffs"])
+    pipeline.add_stage("validated", lambda validation: validation[0], ["validation"])
+    pipeline.add_stage("anomalies", lambda validation: validation[1], ["validation"])
+    pipeline.add_stage("flagged", flagged, ["validated", "period", "iup"])
+    pipeline.add_stage("payment", payment, ["flagged", "tariffs"])
+    return pipeline
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import Instrumentation
+from modul import PaymentRollup
+from tarif import CATEGORIES, ModeRule, RateRule, TableRule
+
+SCENARIO_COL = "Skenario"
+LEVELS = {"prospek": "Prospek", "penggali": "Penggali"}
+
+
+def _stack_rates(rules, df):
+    # Aturan rate dengan kolom yang sama: perkalian kolom dihitung sekali, lalu x vektor tarif
+    groups = {}
+    for i, rule in enumerate(rules):
+        groups.setdefault((tuple(rule.per), rule.fill_missing), []).append(i)
+    values = np.empty((len(df), len(rules)))
+    for indexes in groups.values():
+        base = RateRule(1, rules[indexes[0]].per, rules[indexes[0]].fill_missing).amounts(df)
+        rates = np.array([float(rules[i].rate) for i in indexes])
+        values[:, indexes] = np.round(np.outer(base, rates))
+    return values, np.ones(values.shape, dtype=bool)
+
+
+def _stack_tables(rules, df):
+    # Tabel harga semua skenario digabung ke satu kunci gabungan: nilai dicari sekali (searchsorted),
+    # harga per skenario diambil sebagai matriks [baris x skenario]
+    n, s = len(df), len(rules)
+    values = np.full((n, s), np.nan)
+    found = np.zeros((n, s), dtype=bool)
+    first = rules[0]
+    if first.choice not in df.columns:
+        return values, found
+
+    choice = df[first.choice]
+    has_choice = choice.notna().to_numpy()
+    is_luar = choice.where(choice.notna(), "").astype(str).str.strip().str.lower().eq("luar").to_numpy()
+    keys = pd.to_numeric(df[first.value], errors="coerce").to_numpy(dtype="float64")
+
+    for side, mask in (("luar", has_choice & is_luar), ("lokal", has_choice & ~is_luar)):
+        if not mask.any():
+            continue
+        indexes = [getattr(rule, side) for rule in rules]
+        union = np.unique(np.concatenate([index.keys for index in indexes]))
+        if len(union) == 0:
+            continue
+        table = np.full((len(union), s), np.nan)
+        present = np.zeros((len(union), s), dtype=bool)
+        for j, index in enumerate(indexes):
+            table[np.searchsorted(union, index.keys), j] = index.prices
+            present[np.searchsorted(union, index.keys), j] = True
+
+        pos = np.minimum(np.searchsorted(union, keys[mask]), len(union) - 1)
+        hit = union[pos] == keys[mask]
+        block = np.full((int(mask.sum()), s), np.nan)
+        block_found = np.zeros(block.shape, dtype=bool)
+        block[hit] = table[pos[hit]]
+        block_found[hit] = present[pos[hit]]
+        values[mask] = block
+        found[mask] = block_found
+    return values, found
+
+
+def _stack_modes(rules, df):
+    first = rules[0]
+    if first.mode in df.columns:
+        mode = df[first.mode].astype(str).str.strip().str.lower().to_numpy()
+    else:
+        mode = np.full(len(df), "")
+    values = np.tile(np.array([float(rule.default) for rule in rules]), (len(df), 1))
+    for name in {name for rule in rules for name in rule.rates}:
+        rows = mode == name
+        if not rows.any():
+            continue
+        with_mode = [i for i, rule in enumerate(rules) if name in rule.rates]
+        amounts, _ = _stack_rates([rules[i].rates[name] for i in with_mode], df[rows])
+        block = values[rows]
+        block[:, with_mode] = amounts
+        values[rows] = block
+    return np.round(values), np.ones(values.shape, dtype=bool)
+
+
+def _evaluate_batch(category, tariff_sets, df):
+    # Satu kategori untuk semua skenario sekaligus -> (nilai, ketemu) berbentuk [baris x skenario].
+    # Skenario dengan aturan periode atau tipe aturan campuran dihitung per skenario (tetap vektor).
+    rules = [tariffs.rules[category] for tariffs in tariff_sets]
+    batched = not any(category in rules_ for tariffs in tariff_sets for _, _, rules_ in tariffs.overrides)
+    kinds = {type(rule) for rule in rules}
+    if batched and kinds == {RateRule}:
+        return _stack_rates(rules, df)
+    if batched and kinds == {TableRule} and len({(rule.value, rule.choice) for rule in rules}) == 1:
+        return _stack_tables(rules, df)
+    if batched and kinds == {ModeRule} and len({rule.mode for rule in rules}) == 1:
+        return _stack_modes(rules, df)
+
+    columns = [tariffs.evaluate(category, df)[:2] for tariffs in tariff_sets]
+    return np.column_stack([values for values, _ in columns]), np.column_stack([found for _, found in columns])
+
+
+def evaluate_scenarios(merged, scenarios, instrumentation=None):
+    # Hitung data stage 3 yang sama dengan banyak TariffSet ({nama: TariffSet}) dalam satu lintasan.
+    # Total per skenario sama dengan PaymentCount + PaymentRollup untuk masing-masing tarif.
+    instrumentation = instrumentation or Instrumentation()
+    names = list(scenarios)
+    tariff_sets = [scenarios[name] for name in names]
+
+    with instrumentation.stage("scenario.evaluate", rows_in=len(merged)) as record:
+        # get_result menyimpan baris pertama per Kode Testpit; tarif dihitung per baris, jadi cukup sekali di depan
+        df = merged.drop_duplicates(subset=["Kode Testpit"]) if "Kode Testpit" in merged.columns else merged
+        # Rekap hanya memuat baris dengan semua kunci TPID terisi (sama seperti PaymentRollup)
+        keys = [col for col in PaymentRollup.KEYS if col in df.columns]
+        df = df[df[keys].notna().all(axis=1)].reset_index(drop=True)
+
+        totals = {}
+        for category, column in CATEGORIES.items():
+            values, found = _evaluate_batch(category, tariff_sets, df)
+            # Kebijakan harga kosong (0/null/"keep") bisa berbeda per file tarif -> per kolom skenario
+            for j, tariffs in enumerate(tariff_sets):
+                missing = tariffs.missing(category)
+                if missing == "keep" and column in df.columns:
+                    existing = pd.to_numeric(df[column], errors="coerce").to_numpy(dtype="float64")
+                    values[:, j] = np.where(found[:, j], values[:, j], existing)
+                elif missing not in (None, "keep"):
+                    values[:, j] = np.where(found[:, j], values[:, j], missing)
+            totals[column] = np.nan_to_num(values)
+
+        frames = {}
+        grand = pd.DataFrame({column: matrix.sum(axis=0) for column, matrix in totals.items()}, index=names)
+        grand["Total"] = grand.sum(axis=1)
+        frames["total"] = grand.rename_axis(SCENARIO_COL).reset_index()
+
+        for level, col in LEVELS.items():
+            codes, uniques = pd.factorize(df[col], sort=True)
+            # Satu groupby per kategori untuk semua skenario: [grup x skenario] -> format panjang
+            table = pd.DataFrame({
+                col: np.repeat(np.asarray(uniques, dtype=object), len(names)),
+                SCENARIO_COL: np.tile(np.asarray(names, dtype=object), len(uniques)),
+            })
+            for column, matrix in totals.items():
+                summed = pd.DataFrame(matrix).groupby(codes).sum().reindex(range(len(uniques)), fill_value=0)
+                table[column] = summed.to_numpy().ravel()
+            table["Total"] = table[list(totals)].sum(axis=1)
+            frames[level] = table
+        record["rows_out"] = len(df)
+        record["scenarios"] = len(names)
+    return ScenarioResult(names, frames)
+
+
+class ScenarioResult:
+    def __init__(self, names, frames):
+        self.names = names
+        self.frames = frames
+
+    @property
+    def total(self):
+        return self.frames["total"]
+
+    def by(self, level):
+        return self.frames[level]
+
+    def compare(self, level, value="Total"):
+        # Tabel lebar: satu baris per Prospek/Penggali, satu kolom per skenario
+        table = self.frames[level].pivot(index=LEVELS[level], columns=SCENARIO_COL, values=value)
+        return table[self.names].reset_index()
+
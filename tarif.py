@@ -0,0 +1,450 @@
+import copy
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Kategori pembayaran -> kolom hasil di PaymentCount
+CATEGORIES = {
+    "galian": "Tarif Galian",
+    "samplingan": "Tarif Samplingan",
+    "timbunan": "Tarif Timbunan",
+    "kompensasi": "Tarif Kompensasi",
+    "langsiran": "Tarif Langsiran",
+    "angkutan": "Tarif Angkutan",
+}
+
+
+class PriceIndex:
+    # Tabel harga (CSV hg_*) dikompilasi sekali menjadi indeks kunci -> harga yang terurut
+    def __init__(self, price_df, key_col, price_col="Harga"):
+        table = price_df[[key_col, price_col]].copy()
+        table[key_col] = pd.to_numeric(table[key_col], errors="coerce")
+        # Baris kosong di CSV diabaikan, kunci ganda memakai baris pertama (sama seperti iloc[0])
+        table = table.dropna(subset=[key_col, price_col]).drop_duplicates(subset=[key_col], keep="first")
+        table = table.sort_values(key_col, kind="mergesort")
+        prices = table[price_col]
+        # Baris kosong membuat kolom harga terbaca float; harga bulat tetap dianggap rupiah integer
+        if pd.api.types.is_float_dtype(prices) and np.array_equal(prices, np.round(prices)):
+            prices = prices.astype("int64")
+
+        self.key_col = key_col
+        self.keys = table[key_col].to_numpy(dtype="float64")
+        self.prices = prices.to_numpy(dtype="float64")
+        self.price_dtype = prices.dtype
+
+    @classmethod
+    def compile(cls, source, key_col, price_col="Harga"):
+        if isinstance(source, cls):
+            return source
+        return cls(source, key_col, price_col)
+
+    def lookup(self, values):
+        # Kembalikan (harga, ketemu) per nilai; harga NaN jika kunci tidak ada di tabel
+        values = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype="float64")
+        prices = np.full(len(values), np.nan)
+        if len(self.keys) == 0:
+            return prices, np.zeros(len(values), dtype=bool)
+
+        pos = np.searchsorted(self.keys, values, side="left")
+        pos = np.minimum(pos, len(self.keys) - 1)
+        found = self.keys[pos] == values
+        prices[found] = self.prices[pos[found]]
+        return prices, found
+
+    def digest(self):
+        return hashlib.sha256(
+            self.keys.tobytes() + self.prices.tobytes() + str(self.price_dtype).encode("utf-8")
+        ).hexdigest()
+
+
+def numeric_column(df, col):
+    # Kolom jumlah sebagai float64; kolom yang tidak ada dianggap 0
+    if col not in df.columns:
+        return np.zeros(len(df))
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype="float64")
+
+
+class TableRule:
+    # Harga dari tabel lokal/luar berdasarkan kolom pilihan; kunci dicocokkan persis
+    def __init__(self, value, choice, lokal, luar, missing=None):
+        self.value = value
+        self.choice = choice
+        self.lokal = lokal
+        self.luar = luar
+        self.missing = missing
+        self.integer = all(pd.api.types.is_integer_dtype(i.price_dtype) for i in (lokal, luar))
+
+    def evaluate(self, df):
+        n = len(df)
+        prices = np.full(n, np.nan)
+        found = np.zeros(n, dtype=bool)
+        if self.choice not in df.columns:
+            return prices, found
+
+        choice = df[self.choice]
+        has_choice = choice.notna().to_numpy()
+        is_luar = choice.where(choice.notna(), "").astype(str).str.strip().str.lower().eq("luar").to_numpy()
+        values = df[self.value]
+        for index, mask in ((self.luar, has_choice & is_luar), (self.lokal, has_choice & ~is_luar)):
+            if mask.any():
+                prices[mask], found[mask] = index.lookup(values[mask])
+        return prices, found
+
+    def problems(self, df):
+        # Cek massal tanpa menghitung harga -> [(mask, kolom, masalah)]
+        if self.choice not in df.columns:
+            return [(np.ones(len(df), dtype=bool), self.choice, "kolom tidak ada")]
+        choice = df[self.choice]
+        has_choice = choice.notna().to_numpy()
+        is_luar = choice.where(choice.notna(), "").astype(str).str.strip().str.lower().eq("luar").to_numpy()
+        values = pd.to_numeric(df[self.value], errors="coerce").to_numpy(dtype="float64") \
+            if self.value in df.columns else np.full(len(df), np.nan)
+        found = np.zeros(len(df), dtype=bool)
+        for index, mask in ((self.luar, has_choice & is_luar), (self.lokal, has_choice & ~is_luar)):
+            found[mask] = np.isin(values[mask], index.keys)
+        return [
+            (~has_choice, self.choice, "pilihan lokal/luar kosong"),
+            (has_choice & np.isnan(values), self.value, "nilai kosong"),
+            (has_choice & ~np.isnan(values) & ~found, self.value, "tidak ada di tabel harga"),
+        ]
+
+    def columns(self):
+        return [self.value, self.choice]
+
+    def describe(self):
+        return {"type": "table", "value": self.value, "choice": self.choice, "missing": self.missing,
+                "lokal": self.lokal.digest(), "luar": self.luar.digest()}
+
+
+class RateRule:
+    # tarif x perkalian kolom (kosong = tarif tetap per testpit), dibulatkan ke Rupiah
+    integer = True
+
+    def __init__(self, rate, per=(), fill_missing=None):
+        self.rate = rate
+        self.per = list(per)
+        self.fill_missing = fill_missing
+
+    def amounts(self, df):
+        values = np.full(len(df), float(self.rate))
+        for col in self.per:
+            column = numeric_column(df, col)
+            if self.fill_missing is not None:
+                column = np.where(np.isnan(column), self.fill_missing, column)
+            values = values * column
+        return values
+
+    def evaluate(self, df):
+        return np.round(self.amounts(df)), np.ones(len(df), dtype=bool)
+
+    def problems(self, df):
+        problems = []
+        for col in self.per:
+            if col not in df.columns:
+                problems.append((np.ones(len(df), dtype=bool), col, "kolom tidak ada"))
+            elif self.fill_missing is None:
+                problems.append((np.isnan(numeric_column(df, col)), col, "nilai kosong"))
+        return problems
+
+    def columns(self):
+        return list(self.per)
+
+    def describe(self):
+        return {"type": "rate", "rate": self.rate, "per": self.per, "fill_missing": self.fill_missing}
+
+
+class ModeRule:
+    # Tarif berbeda per nilai kolom mode (mis. SistemAngkutan koli/kilo); mode lain -> default
+    integer = True
+
+    def __init__(self, mode, rates, default=0):
+        self.mode = mode
+        self.rates = rates
+        self.default = default
+
+    def evaluate(self, df):
+        if self.mode in df.columns:
+            mode = df[self.mode].astype(str).str.strip().str.lower().to_numpy()
+        else:
+            mode = np.full(len(df), "")
+        values = np.select(
+            [mode == name for name in self.rates],
+            [rule.amounts(df) for rule in self.rates.values()],
+            default=self.default,
+        )
+        return np.round(values), np.ones(len(df), dtype=bool)
+
+    def problems(self, df):
+        if self.mode not in df.columns:
+            return [(np.ones(len(df), dtype=bool), self.mode, "kolom tidak ada")]
+        mode = df[self.mode].astype(str).str.strip().str.lower().to_numpy()
+        problems = [(~np.isin(mode, list(self.rates)), self.mode, f"mode tidak dikenal (tarif {self.default})")]
+        for name, rule in self.rates.items():
+            selected = mode == name
+            problems.extend((mask & selected, col, message) for mask, col, message in rule.problems(df))
+        return problems
+
+    def columns(self):
+        return [self.mode] + [col for rule in self.rates.values() for col in rule.columns()]
+
+    def describe(self):
+        return {"type": "by_mode", "mode": self.mode, "default": self.default,
+                "rates": {name: rule.describe() for name, rule in self.rates.items()}}
+
+
+class TariffSet:
+    # Aturan tarif terkompilasi untuk satu IUP: aturan default + aturan per periode (Tanggal Sampling)
+    def __init__(self, rules, overrides=()):
+        self.rules = rules
+        self.overrides = list(overrides)  # [(mulai, selesai, {kategori: aturan})]
+
+    def evaluate(self, category, df):
+        # -> (nilai float64, ketemu, integer); aturan periode menggantikan default pada barisnya
+        values, found = self.rules[category].evaluate(df)
+        for mask, override in self._periods(category, df):
+            override_values, override_found = override.evaluate(df)
+            values = np.where(mask, override_values, values)
+            found = np.where(mask, override_found, found)
+        return values, found, self.integer(category, df)
+
+    def _periods(self, category, df):
+        # (mask baris, aturan) untuk setiap aturan periode kategori ini yang mengenai data
+        periods = [(start, end, rules[category]) for start, end, rules in self.overrides if category in rules]
+        if not periods:
+            return
+        dates = pd.to_datetime(df["Tanggal Sampling"], errors="coerce") if "Tanggal Sampling" in df.columns \
+            else pd.Series(pd.NaT, index=df.index)
+        for start, end, override in periods:
+            mask = dates.notna().to_numpy()
+            if start is not None:
+                mask &= (dates >= start).to_numpy()
+            if end is not None:
+                mask &= (dates <= end).to_numpy()
+            if mask.any():
+                yield mask, override
+
+    def problems(self, category, df):
+        # Masalah input per baris untuk satu kategori, memakai aturan yang berlaku di baris itu
+        active = np.ones(len(df), dtype=bool)
+        checks = []
+        for mask, override in reversed(list(self._periods(category, df))):
+            checks.append((mask & active, override))
+            active &= ~mask
+        checks.append((active, self.rules[category]))
+        return [
+            (mask & applies, col, message)
+            for applies, rule in checks
+            for mask, col, message in rule.problems(df)
+        ]
+
+    def missing(self, category):
+        return getattr(self.rules[category], "missing", None)
+
+    def integer(self, category, df):
+        # Apakah hasil evaluate untuk df bertipe integer (aturan default + aturan periode yang mengenai df)
+        return self.rules[category].integer and all(override.integer for _, override in self._periods(category, df))
+
+    def columns(self):
+        # Kolom input yang dibaca aturan (termasuk aturan periode), tanpa duplikat
+        rules = list(self.rules.values()) + [rule for _, _, period in self.overrides for rule in period.values()]
+        columns = [col for rule in rules for col in rule.columns()]
+        if self.overrides:
+            columns.append("Tanggal Sampling")
+        return list(dict.fromkeys(columns))
+
+    def fingerprint(self):
+        spec = {
+            "rules": {name: rule.describe() for name, rule in self.rules.items()},
+            "overrides": [
+                [str(start), str(end), {name: rule.describe() for name, rule in rules.items()}]
+                for start, end, rules in self.overrides
+            ],
+        }
+        return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def tariff_column(values, integer):
+    # Integer jika semua sumber integer dan tidak ada NaN, selain itu float64
+    if integer and not np.isnan(values).any():
+        return values.astype("int64")
+    return values
+
+
+def default_rules(harga_galian_lokal, harga_galian_luar, harga_samplingan_lokal, harga_samplingan_luar,
+                  timbunan_per_meter=12000, kompensasi=90000, langsiran_per_koli=1000,
+                  angkutan_per_koli=1000, angkutan_per_kilo=1000):
+    return {
+        "galian": TableRule(
+            "Total Kedalaman", "Harga Galian (Lokal/Luar)",
+            PriceIndex.compile(harga_galian_lokal, "Kedalaman"), PriceIndex.compile(harga_galian_luar, "Kedalaman"),
+            missing="keep",
+        ),
+        "samplingan": TableRule(
+            "Total Koli", "Harga Samplingan (Lokal/Luar)",
+            PriceIndex.compile(harga_samplingan_lokal, "Total Koli"), PriceIndex.compile(harga_samplingan_luar, "Total Koli"),
+            missing=0,
+        ),
+        "timbunan": RateRule(timbunan_per_meter, ["Total Kedalaman"]),
+        "kompensasi": RateRule(kompensasi),
+        "langsiran": RateRule(langsiran_per_koli, ["Penimbun", "Total Koli"]),
+        "angkutan": ModeRule("SistemAngkutan", {
+            "koli": RateRule(angkutan_per_koli, ["Total Koli", "Pengangkut"], fill_missing=0),
+            "kilo": RateRule(angkutan_per_kilo, ["Pengangkut"], fill_missing=0),
+        }),
+    }
+
+
+class TariffConfig:
+    # File tarif deklaratif (JSON): "default" berisi keenam kategori, "overrides" mengganti sebagian
+    # kategori untuk IUP tertentu dan/atau rentang Tanggal Sampling. Divalidasi dan dikompilasi sekali.
+    RULE_TYPES = ("table", "rate", "by_mode")
+
+    def __init__(self, spec, base_dir="."):
+        self.spec = spec
+        self.base_dir = base_dir
+        self._tables = {}
+        self._resolved = {}
+        self.errors = []
+        self.default = self._compile_rules(spec.get("default"), "default", require_all=True)
+        self.overrides = []
+        for i, override in enumerate(spec.get("overrides", [])):
+            where = f"overrides[{i}]"
+            if not isinstance(override, dict):
+                self.errors.append(f"{where}: must be an object")
+                continue
+            start = self._parse_date(override.get("from"), f"{where}.from")
+            end = self._parse_date(override.get("to"), f"{where}.to")
+            if start is not None and end is not None and start > end:
+                self.errors.append(f"{where}: 'from' is after 'to'")
+            rules = self._compile_rules(override.get("tarif"), f"{where}.tarif", require_all=False)
+            self.overrides.append((override.get("iup"), start, end, rules))
+        if self.errors:
+            raise ValueError("Invalid tariff configuration:\n- " + "\n- ".join(self.errors))
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                spec = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ValueError(f"Failed to load tariff configuration '{path}': {e}")
+        return cls(spec, os.path.dirname(os.path.abspath(path)))
+
+    def resolve(self, iup=None):
+        # TariffSet untuk satu IUP: override tanpa periode diterapkan langsung ke aturan default
+        if iup not in self._resolved:
+            rules = dict(self.default)
+            periods = []
+            for override_iup, start, end, override_rules in self.overrides:
+                if override_iup is not None and override_iup != iup:
+                    continue
+                if start is None and end is None:
+                    rules.update(override_rules)
+                else:
+                    periods.append((start, end, override_rules))
+            self._resolved[iup] = TariffSet(rules, periods)
+        return self._resolved[iup]
+
+    def _parse_date(self, value, where):
+        if value is None:
+            return None
+        try:
+            return pd.Timestamp(value)
+        except (TypeError, ValueError):
+            self.errors.append(f"{where}: invalid date {value!r}")
+            return None
+
+    def _compile_rules(self, spec, where, require_all):
+        if not isinstance(spec, dict):
+            self.errors.append(f"{where}: must be an object with tariff categories")
+            return {}
+        unknown = sorted(set(spec) - set(CATEGORIES))
+        if unknown:
+            self.errors.append(f"{where}: unknown categories {unknown}")
+        if require_all:
+            missing = [name for name in CATEGORIES if name not in spec]
+            if missing:
+                self.errors.append(f"{where}: missing categories {missing}")
+        return {
+            name: rule for name, rule in
+            ((name, self._compile_rule(spec[name], f"{where}.{name}")) for name in CATEGORIES if name in spec)
+            if rule is not None
+        }
+
+    def _compile_rule(self, spec, where):
+        if not isinstance(spec, dict) or spec.get("type") not in self.RULE_TYPES:
+            self.errors.append(f"{where}: 'type' must be one of {list(self.RULE_TYPES)}")
+            return None
+        spec = copy.deepcopy(spec)
+        kind = spec.pop("type")
+        if kind == "table":
+            return self._compile_table(spec, where)
+        if kind == "rate":
+            return self._compile_rate(spec, where)
+
+        rates = spec.get("rates")
+        if not isinstance(rates, dict) or not rates:
+            self.errors.append(f"{where}.rates: must be a non-empty object")
+            return None
+        compiled = {}
+        for name, rate_spec in rates.items():
+            rule = self._compile_rate(rate_spec, f"{where}.rates.{name}") if isinstance(rate_spec, dict) else None
+            if rule is None and not isinstance(rate_spec, dict):
+                self.errors.append(f"{where}.rates.{name}: must be an object")
+            if rule is not None:
+                compiled[str(name).strip().lower()] = rule
+        default = spec.get("default", 0)
+        if not self._is_amount(default):
+            self.errors.append(f"{where}.default: must be a non-negative number")
+        if not isinstance(spec.get("mode"), str):
+            self.errors.append(f"{where}.mode: must be a column name")
+            return None
+        return ModeRule(spec["mode"], compiled, default)
+
+    def _compile_rate(self, spec, where):
+        rate = spec.get("rate")
+        per = spec.get("per", [])
+        fill_missing = spec.get("fill_missing")
+        ok = True
+        if not self._is_amount(rate):
+            self.errors.append(f"{where}.rate: must be a non-negative number")
+            ok = False
+        if not isinstance(per, list) or not all(isinstance(col, str) for col in per):
+            self.errors.append(f"{where}.per: must be a list of column names")
+            ok = False
+        if fill_missing is not None and not self._is_amount(fill_missing):
+            self.errors.append(f"{where}.fill_missing: must be a number or null")
+            ok = False
+        return RateRule(rate, per, fill_missing) if ok else None
+
+    def _compile_table(self, spec, where):
+        missing = spec.get("missing")
+        if missing != "keep" and missing is not None and not self._is_amount(missing):
+            self.errors.append(f"{where}.missing: must be \"keep\", null or a number")
+        for field in ("value", "choice", "table_key", "lokal", "luar"):
+            if not isinstance(spec.get(field), str):
+                self.errors.append(f"{where}.{field}: required")
+                return None
+        lokal = self._table(spec["lokal"], spec["table_key"], f"{where}.lokal")
+        luar = self._table(spec["luar"], spec["table_key"], f"{where}.luar")
+        if lokal is None or luar is None:
+            return None
+        return TableRule(spec["value"], spec["choice"], lokal, luar, missing)
+
+    def _table(self, filename, key_col, where):
+        # Tabel yang sama (file + kunci) hanya dibaca dan dikompilasi sekali
+        path = filename if os.path.isabs(filename) else os.path.join(self.base_dir, filename)
+        if (path, key_col) not in self._tables:
+            try:
+                self._tables[(path, key_col)] = PriceIndex(pd.read_csv(path), key_col)
+            except Exception as e:
+                self.errors.append(f"{where}: cannot load price table '{filename}': {e}")
+                return None
+        return self._tables[(path, key_col)]
+
+    @staticmethod
+    def _is_amount(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
@@ -0,0 +1,66 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from tarif import CATEGORIES
+
+logger = logging.getLogger(__name__)
+
+KEY = "Kode Testpit"
+ANOMALY_COLUMNS = ["Kode Testpit", "Prospek", "Penggali", "Kategori", "Kolom", "Nilai", "Masalah"]
+
+
+def _anomalies(df, mask, category, column, message):
+    rows = df.iloc[np.flatnonzero(mask)]
+    report = pd.DataFrame({
+        col: rows[col].astype(object).to_numpy() if col in rows.columns else None
+        for col in ("Kode Testpit", "Prospek", "Penggali")
+    })
+    report["Kategori"] = category
+    report["Kolom"] = column
+    report["Nilai"] = rows[column].astype(object).to_numpy() if column in rows.columns else None
+    report["Masalah"] = message
+    return report
+
+
+def validate_for_pricing(merged, tariffs, drop_invalid=False):
+    # Sebelum perhitungan tarif: buang duplikat Kode Testpit (baris pertama dipakai, sama seperti
+    # get_result) dan cek semua baris terhadap aturan tarif sekaligus -> (data untuk dihitung, laporan
+    # anomali). drop_invalid=True menahan baris bermasalah; default tetap dihitung (tarif NaN/0/isi
+    # bawaan seperti sebelumnya) supaya pembayaran tidak hilang diam-diam.
+    if merged is None:
+        return None, pd.DataFrame(columns=ANOMALY_COLUMNS)
+
+    reports = []
+    positions = []
+    df = merged
+    kept = np.arange(len(merged))
+    if KEY in merged.columns:
+        duplicated = merged.duplicated(subset=[KEY], keep="first").to_numpy()
+        for mask, message in ((duplicated, "duplikat, baris pertama yang dipakai"),
+                              (merged[KEY].isna().to_numpy() & ~duplicated, "nilai kosong")):
+            if mask.any():
+                reports.append(_anomalies(merged, mask, None, KEY, message))
+                positions.append(np.flatnonzero(mask))
+        df = merged.loc[~duplicated]
+        kept = kept[~duplicated]
+
+    invalid = np.zeros(len(df), dtype=bool)
+    for category in CATEGORIES:
+        for mask, column, message in tariffs.problems(category, df):
+            if mask.any():
+                reports.append(_anomalies(df, mask, category, column, message))
+                positions.append(kept[mask])
+                invalid |= mask
+
+    # Laporan urut sesuai baris input, lalu urutan pengecekan
+    report = pd.concat(reports, ignore_index=True) if reports else pd.DataFrame(columns=ANOMALY_COLUMNS)
+    if len(report):
+        report = report.iloc[np.argsort(np.concatenate(positions), kind="stable")].reset_index(drop=True)
+        logger.warning("validation: %d anomalies, %d of %d rows invalid, %d duplicates",
+                       len(report), int(invalid.sum()), len(df), len(merged) - len(df))
+
+    if drop_invalid and invalid.any():
+        df = df.loc[~invalid]
+    return df, report.reindex(columns=ANOMALY_COLUMNS)